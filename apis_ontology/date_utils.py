@@ -2,14 +2,18 @@
 This module contains utility functions for working with dates.
 
 - parser functions for reading a range of dates
+- a batch parser for imports and re-indexing
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from typing import Tuple
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Tuple
 import calendar
 import logging
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+import numpy as np
 
 from django_interval.utils import DateTuple
 import re
@@ -19,6 +23,20 @@ from apis_ontology.hijri_util import incomplete_hijridate_to_interval
 
 logger = logging.getLogger(__name__)
 
+# bump this whenever a change of the parser changes the dates it derives,
+# `reparse_dates` then re-derives the dates parsed by older versions
+DATE_GRAMMAR_VERSION = 1
+
+# number of distinct normalized date strings whose parse result is kept
+PARSE_CACHE_SIZE = 4096
+# below this number of distinct date strings a batch is parsed in process,
+# starting worker processes costs more than it saves
+PARALLEL_PARSE_THRESHOLD = 20000
+PARALLEL_PARSE_CHUNK_SIZE = 2000
+
+TAG_PATTERN = re.compile(r"<.*?>")
+DESC_RANGE_PATTERN = re.compile(r"\b(before|not after|not before|after)\s+(.+)")
+
 
 class DateType(Enum):
     START_DATE = "start_date"
@@ -147,64 +165,155 @@ def nomansland_dateparser(
     """
     # https://nomansland.acdh-dev.oeaw.ac.at/apis/entities/entity/manuscript/21153/detail
     # 	- before 496/1102-3v
-    original_date_string = date_string
-    date_string = date_string.lower().replace(".", "")
-    date_string = re.sub(r"<.*?>", "", date_string).strip()
-
-    dates = DateTuple()
+    normalized_date_string = normalize_date_string(date_string)
     try:
-        if " - " in date_string:
-            range_parts = date_string.split(" - ")
-            _, from_date, _ = incomplete_date_to_interval(range_parts[0])
-            _, _, to_date = incomplete_date_to_interval(range_parts[1])
-            dates.set_range(from_date, to_date)
-        elif date_string.startswith("-"):
-            _, _, dates.to_date = incomplete_date_to_interval(date_string[1:])
-        elif date_string.endswith("-"):
-            _, dates.from_date, _ = incomplete_date_to_interval(date_string[:-1])
-        else:
-            pattern_desc_range = r"\b(before|not after|not before|after)\s+(.+)"
-            matches_desc_range = re.finditer(pattern_desc_range, date_string)
-            groups_desc_range = {
-                match.group(1): match.group(2) for match in matches_desc_range
-            }
-
-            if groups_desc_range:
-                # before/after type of input
-                for desc, date in groups_desc_range.items():
-                    _, interval_start, interval_end = incomplete_date_to_interval(date)
-                    if desc == "not after":
-                        # to_date will be set to the beginning of the interval
-                        dates.to_date = interval_end
-                    elif desc == "after":
-                        # from_date will be set one day after the end of the interval
-                        dates.from_date = interval_end + timedelta(days=1)
-                    elif desc == "before":
-                        # to_date will be set to one day before this interval's beginning
-                        dates.to_date = interval_start - timedelta(days=1)
-
-                    elif desc == "not before":
-                        # from_date will be set to this date
-                        dates.from_date = interval_start
-
-                if dates.from_date and dates.to_date:
-                    dates.set_range(dates.from_date, dates.to_date)
-            else:
-                # convert a single date to interval
-                dates.sort_date, dates.from_date, dates.to_date = (
-                    incomplete_date_to_interval(date_string)
-                )
-
+        return _parse_normalized_date_string(normalized_date_string)
     except Exception as e:
         logger.error(
             "Could not parse date: '%s (%s)' due to error: %s",
-            original_date_string,
             date_string,
+            normalized_date_string,
             e,
         )
         raise e
 
+
+def normalize_date_string(date_string: str) -> str:
+    """
+    Lowercase the date string and drop dots and html tags, the parser
+    only ever sees this form.
+    """
+    date_string = date_string.lower().replace(".", "")
+    return TAG_PATTERN.sub("", date_string).strip()
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized_date_string(
+    date_string: str,
+) -> Tuple[datetime, datetime, datetime]:
+    # the same literals ("4c ah", "c 550 ah") occur in thousands of records,
+    # so results are cached; they are tuples of immutable datetimes
+    dates = DateTuple()
+    if " - " in date_string:
+        range_parts = date_string.split(" - ")
+        _, from_date, _ = incomplete_date_to_interval(range_parts[0])
+        _, _, to_date = incomplete_date_to_interval(range_parts[1])
+        dates.set_range(from_date, to_date)
+    elif date_string.startswith("-"):
+        _, _, dates.to_date = incomplete_date_to_interval(date_string[1:])
+    elif date_string.endswith("-"):
+        _, dates.from_date, _ = incomplete_date_to_interval(date_string[:-1])
+    else:
+        matches_desc_range = DESC_RANGE_PATTERN.finditer(date_string)
+        groups_desc_range = {
+            match.group(1): match.group(2) for match in matches_desc_range
+        }
+
+        if groups_desc_range:
+            # before/after type of input
+            for desc, date in groups_desc_range.items():
+                _, interval_start, interval_end = incomplete_date_to_interval(date)
+                if desc == "not after":
+                    # to_date will be set to the beginning of the interval
+                    dates.to_date = interval_end
+                elif desc == "after":
+                    # from_date will be set one day after the end of the interval
+                    dates.from_date = interval_end + timedelta(days=1)
+                elif desc == "before":
+                    # to_date will be set to one day before this interval's beginning
+                    dates.to_date = interval_start - timedelta(days=1)
+
+                elif desc == "not before":
+                    # from_date will be set to this date
+                    dates.from_date = interval_start
+
+            if dates.from_date and dates.to_date:
+                dates.set_range(dates.from_date, dates.to_date)
+        else:
+            # convert a single date to interval
+            dates.sort_date, dates.from_date, dates.to_date = (
+                incomplete_date_to_interval(date_string)
+            )
+
     if not dates.sort_date:
         dates.sort_date = dates.from_date or dates.to_date
 
     return dates.tuple()
+
+
+class ParsedDates(NamedTuple):
+    """
+    The result of `parse_dates`, one entry per input string. The dates are
+    `datetime64[D]` arrays with `NaT` for missing dates, `failed` marks the
+    strings that could not be parsed.
+    """
+
+    sort_date: np.ndarray
+    from_date: np.ndarray
+    to_date: np.ndarray
+    failed: np.ndarray
+
+
+def _parse_normalized_date_strings(date_strings):
+    results = []
+    for date_string in date_strings:
+        try:
+            results.append(_parse_normalized_date_string(date_string))
+        except Exception as e:
+            logger.error("Could not parse date: '%s' due to error: %s", date_string, e)
+            results.append(None)
+    return results
+
+
+def parse_dates(date_strings: Iterable[str], workers: int = 1) -> ParsedDates:
+    """
+    Parse many date strings at once, like `nomansland_dateparser` does
+    for a single one. Empty values give empty dates, strings that can not
+    be parsed are marked as failed instead of raising.
+    Every distinct normalized string is parsed only once. With more than
+    one worker, large batches are parsed in a pool of worker processes.
+    """
+    normalized = [
+        normalize_date_string(date_string) if date_string else None
+        for date_string in date_strings
+    ]
+    unique = list(dict.fromkeys(value for value in normalized if value is not None))
+
+    if workers > 1 and len(unique) >= PARALLEL_PARSE_THRESHOLD:
+        chunks = [
+            unique[start : start + PARALLEL_PARSE_CHUNK_SIZE]
+            for start in range(0, len(unique), PARALLEL_PARSE_CHUNK_SIZE)
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [
+                result
+                for chunk_results in executor.map(
+                    _parse_normalized_date_strings, chunks
+                )
+                for result in chunk_results
+            ]
+    else:
+        results = _parse_normalized_date_strings(unique)
+
+    # one row per distinct string, the inputs only carry an index into it
+    unique_dates = np.full(
+        (len(unique) + 1, 3), np.datetime64("NaT", "D"), dtype="datetime64[D]"
+    )
+    unique_failed = np.zeros(len(unique) + 1, dtype=bool)
+    for row, result in enumerate(results, start=1):
+        if result is None:
+            unique_failed[row] = True
+        else:
+            unique_dates[row] = [
+                np.datetime64("NaT", "D") if value is None else value
+                for value in result
+            ]
+
+    index = {value: row for row, value in enumerate(unique, start=1)}
+    rows = np.fromiter(
+        (index.get(value, 0) for value in normalized),
+        dtype=np.intp,
+        count=len(normalized),
+    )
+    dates = unique_dates[rows]
+    return ParsedDates(dates[:, 0], dates[:, 1], dates[:, 2], unique_failed[rows])
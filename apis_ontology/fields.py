@@ -0,0 +1,88 @@
+from functools import partial
+
+from django.db import models
+from django_interval.fields import FuzzyDateParserField
+
+from .date_utils import DATE_GRAMMAR_VERSION, normalize_date_string
+
+PARSE_STATUS_PARSED = "parsed"
+PARSE_STATUS_FAILED = "failed"
+PARSE_STATUS_CHOICES = [
+    (PARSE_STATUS_PARSED, "Parsed"),
+    (PARSE_STATUS_FAILED, "Failed"),
+]
+
+STATE_SUFFIXES = ["_date_normalized", "_date_grammar_version", "_date_parse_status"]
+
+
+def parse_state(value, failed=False):
+    """
+    The normalized form, grammar version and parse status stored for a raw
+    date string, all of them empty for an empty string.
+    """
+    if not value:
+        return None, None, None
+    status = PARSE_STATUS_FAILED if failed else PARSE_STATUS_PARSED
+    return normalize_date_string(value), DATE_GRAMMAR_VERSION, status
+
+
+def _state_field_pre_save(self, model_instance, add):
+    # the same conditions as the generated date fields of django_interval
+    skip_date_interval_populate = getattr(
+        model_instance, "skip_date_interval_populate", False
+    )
+    is_history_model = hasattr(model_instance, "history_id")
+    if not skip_date_interval_populate and not is_history_model:
+        value = getattr(model_instance, self.parent_name)
+        # the state is shared by the state fields of the date field
+        states = model_instance.__dict__.setdefault("_date_parse_states", {})
+        if self.parent_name not in states or states[self.parent_name][0] != value:
+            parent_field = model_instance._meta.get_field(self.parent_name)
+            states[self.parent_name] = (
+                value,
+                dict(zip(parent_field.state_field_names, parse_state(value))),
+            )
+        setattr(model_instance, self.attname, states[self.parent_name][1][self.attname])
+    return type(self).pre_save(self, model_instance, add)
+
+
+class TrackedFuzzyDateParserField(FuzzyDateParserField):
+    """
+    A `FuzzyDateParserField` that also stores the normalized form of the
+    date string, the grammar version it was parsed with and whether that
+    succeeded, in the generated fields `<name>_date_normalized`,
+    `<name>_date_grammar_version` and `<name>_date_parse_status`.
+    Saving a record whose date string can not be parsed fails, so only
+    `reparse_dates` ever records a failed parse.
+    """
+
+    def add_generated_state_field(self, cls, name, parent_name, field):
+        field.pre_save = partial(_state_field_pre_save, field)
+        field.parent_name = parent_name
+        cls.add_to_class(name, field)
+        setattr(self, f"_{name}", field)
+
+    def contribute_to_class(self, cls, name):
+        state_fields = [
+            models.TextField(editable=False, blank=True, null=True, auto_created=True),
+            models.PositiveSmallIntegerField(
+                editable=False, blank=True, null=True, auto_created=True
+            ),
+            models.CharField(
+                max_length=6,
+                choices=PARSE_STATUS_CHOICES,
+                editable=False,
+                blank=True,
+                null=True,
+                auto_created=True,
+            ),
+        ]
+        for suffix, field in zip(STATE_SUFFIXES, state_fields):
+            field_name = f"{name}{suffix}"
+            if not hasattr(self, f"_{field_name}") and not cls.__module__ == "__fake__":
+                self.add_generated_state_field(cls, field_name, name, field)
+        super().contribute_to_class(cls, name)
+
+    @property
+    def state_field_names(self):
+        return [f"{self.name}{suffix}" for suffix in STATE_SUFFIXES]
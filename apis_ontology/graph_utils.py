@@ -0,0 +1,859 @@
+"""
+This module contains utility classes for working with the graph snapshot.
+
+- a columnar, dictionary encoded storage format for graphs
+- an inverted n-gram index for searching nodes and links
+- a CSR adjacency index for neighbourhood queries
+- a small LRU cache for data derived from a snapshot
+"""
+
+import io
+import json
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+import numpy as np
+
+
+def group_positions(codes, size):
+    """
+    Group the positions of `codes` by their value, which has to be in
+    `range(size)`. The positions of the value `i` are
+    `positions[indptr[i]:indptr[i + 1]]`.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=size), out=indptr[1:])
+    positions = np.argsort(codes, kind="stable")
+    return indptr, positions
+
+
+def gather(indptr, values, rows):
+    """
+    Concatenate the slices `values[indptr[row]:indptr[row + 1]]` of all `rows`.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return values[:0]
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return values[offsets + np.arange(total)]
+
+
+def count_degrees(node_ids, sources, targets):
+    """
+    Count the links touching each of `node_ids`, given the source and
+    target ids of the links. Endpoints that are not in `node_ids` are
+    ignored.
+    """
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    if not len(node_ids):
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(node_ids, kind="stable")
+    sorted_ids = node_ids[order]
+    endpoints = np.concatenate(
+        [np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)]
+    )
+    positions = np.minimum(np.searchsorted(sorted_ids, endpoints), len(node_ids) - 1)
+    found = sorted_ids[positions] == endpoints
+    degrees = np.empty(len(node_ids), dtype=np.int64)
+    degrees[order] = np.bincount(positions[found], minlength=len(node_ids))
+    return degrees
+
+
+def node_sizes(degrees, max_size=6, base_size=4, scale=10):
+    """
+    Scale node degrees to sizes between `base_size` and
+    `base_size + max_size`, growing with the arc tangent of the degree.
+    """
+    degrees = np.asarray(degrees, dtype=np.float64)
+    return np.round(base_size + max_size * (np.arctan(degrees / scale) / (np.pi / 2)), 2)
+
+
+class GraphData:
+    """
+    Columnar, dictionary encoded graph snapshot. Every string is stored
+    once in a lookup table and nodes and links are NumPy arrays:
+
+    - `node_id`, `node_size`: id and size of the nodes, sorted by id
+    - `node_label`, `node_group`: positions in the `labels` and `groups` tables
+    - `collection_indptr`, `collection_index`: the collections of the node
+      at position `i` are `collection_index[collection_indptr[i]:collection_indptr[i + 1]]`,
+      positions in the `collections` table of `[id, label]` pairs
+    - `link_id`, `link_source`, `link_target`: relation id and node ids of the links
+    - `link_type`: position in the `link_types` table of `[label, reverse label]` pairs
+
+    Link endpoints are node ids instead of node positions so that the links
+    of a collection shard can point to nodes outside of the shard.
+    """
+
+    ARRAYS = {
+        "node_id": np.int64,
+        "node_label": np.int32,
+        "node_group": np.int16,
+        "node_size": np.float32,
+        "collection_indptr": np.int64,
+        "collection_index": np.int32,
+        "link_id": np.int64,
+        "link_source": np.int64,
+        "link_target": np.int64,
+        "link_type": np.int16,
+    }
+    TABLES = ["labels", "groups", "collections", "link_types"]
+
+    def __init__(self, **columns):
+        for name, dtype in self.ARRAYS.items():
+            setattr(self, name, np.asarray(columns.get(name, ()), dtype=dtype))
+        for name in self.TABLES:
+            setattr(self, name, list(columns.get(name, ())))
+        if not len(self.collection_indptr):
+            self.collection_indptr = np.zeros(self.node_count + 1, dtype=np.int64)
+
+    @property
+    def node_count(self):
+        return len(self.node_id)
+
+    @property
+    def link_count(self):
+        return len(self.link_id)
+
+    @classmethod
+    def from_dicts(cls, nodes, links):
+        """
+        Encode the node and link dicts of the graph payload.
+        """
+        labels, groups, collections, link_types = {}, {}, {}, {}
+        node_label, node_group, node_size = [], [], []
+        collection_indptr, collection_index = [0], []
+        nodes = sorted(nodes, key=lambda node: node["id"])
+        for node in nodes:
+            node_label.append(labels.setdefault(node.get("label", ""), len(labels)))
+            node_group.append(groups.setdefault(node.get("group", ""), len(groups)))
+            node_size.append(node.get("size", 0))
+            for collection in node.get("collections", []):
+                collection_index.append(
+                    collections.setdefault(
+                        collection["id"],
+                        (len(collections), collection.get("label", "")),
+                    )[0]
+                )
+            collection_indptr.append(len(collection_index))
+
+        link_type = []
+        for link in links:
+            link_type.append(
+                link_types.setdefault(
+                    (link.get("label", ""), link.get("reverse_label", "")),
+                    len(link_types),
+                )
+            )
+
+        return cls(
+            node_id=[node["id"] for node in nodes],
+            node_label=node_label,
+            node_group=node_group,
+            node_size=node_size,
+            collection_indptr=collection_indptr,
+            collection_index=collection_index,
+            link_id=[link["id"] for link in links],
+            link_source=[link["source"] for link in links],
+            link_target=[link["target"] for link in links],
+            link_type=link_type,
+            labels=list(labels),
+            groups=list(groups),
+            collections=[
+                [collection_id, label]
+                for collection_id, (_, label) in collections.items()
+            ],
+            link_types=[list(link_type) for link_type in link_types],
+        )
+
+    def to_bytes(self):
+        tables = json.dumps({name: getattr(self, name) for name in self.TABLES})
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            tables=np.frombuffer(tables.encode(), dtype=np.uint8),
+            **{name: getattr(self, name) for name in self.ARRAYS},
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            columns = {name: arrays[name] for name in cls.ARRAYS}
+            columns.update(json.loads(arrays["tables"].tobytes()))
+        return cls(**columns)
+
+    @cached_property
+    def node_positions(self):
+        """
+        Map node ids to their positions.
+        """
+        return dict(zip(self.node_id.tolist(), range(self.node_count)))
+
+    def positions_of(self, node_ids):
+        """
+        Return the positions of `node_ids` and a mask of the ids that are
+        nodes of this graph.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        positions = np.searchsorted(self.node_id, node_ids)
+        positions = np.minimum(positions, max(self.node_count - 1, 0))
+        if not self.node_count:
+            return positions, np.zeros(len(node_ids), dtype=bool)
+        return positions, self.node_id[positions] == node_ids
+
+    def collection_counts(self):
+        """
+        Count the nodes of every collection in the `collections` table.
+        """
+        return np.bincount(self.collection_index, minlength=len(self.collections))
+
+    def degrees(self, link_positions=None):
+        """
+        Count the links touching every node, only counting the links at
+        `link_positions` if given.
+        """
+        sources, targets = self.link_source, self.link_target
+        if link_positions is not None:
+            sources, targets = sources[link_positions], targets[link_positions]
+        return count_degrees(self.node_id, sources, targets)
+
+    @cached_property
+    def link_source_position(self):
+        return self.positions_of(self.link_source)[0]
+
+    @cached_property
+    def link_target_position(self):
+        return self.positions_of(self.link_target)[0]
+
+    @cached_property
+    def internal_links(self):
+        """
+        Mask of the links whose endpoints are both nodes of this graph.
+        Shards also hold links to nodes of other collections, the node
+        positions of their other endpoint are meaningless.
+        """
+        if not self.node_count:
+            return np.zeros(self.link_count, dtype=bool)
+        return (self.node_id[self.link_source_position] == self.link_source) & (
+            self.node_id[self.link_target_position] == self.link_target
+        )
+
+    @cached_property
+    def incident_links(self):
+        """
+        Adjacency index in CSR form: the positions of the links of the node
+        at position `i` are `links[indptr[i]:indptr[i + 1]]`. Returns
+        `(indptr, links)`. Links to nodes outside of the graph are left
+        out.
+        """
+        internal = np.flatnonzero(self.internal_links)
+        indptr, positions = group_positions(
+            np.concatenate(
+                [
+                    self.link_source_position[internal],
+                    self.link_target_position[internal],
+                ]
+            ),
+            self.node_count,
+        )
+        return indptr, internal[positions % max(len(internal), 1)]
+
+    def neighbourhood(self, positions, depth=1):
+        """
+        Return the sorted positions of the nodes at most `depth` links away
+        from the nodes at `positions`, and of the links between them.
+        """
+        visited = np.zeros(self.node_count, dtype=bool)
+        frontier = np.unique(np.asarray(positions, dtype=np.int64))
+        visited[frontier] = True
+        for _ in range(depth):
+            links = gather(*self.incident_links, frontier)
+            ends = np.concatenate(
+                [self.link_source_position[links], self.link_target_position[links]]
+            )
+            frontier = np.unique(ends[~visited[ends]])
+            if not len(frontier):
+                break
+            visited[frontier] = True
+
+        node_positions = np.flatnonzero(visited)
+        link_positions = np.unique(gather(*self.incident_links, node_positions))
+        return node_positions, self.induced(node_positions, link_positions)
+
+    def node_dicts(self, positions=None, collections=True, sizes=None):
+        """
+        Return the nodes at `positions` as dicts. `sizes` replaces the
+        stored node sizes, it is indexed by node position.
+        """
+        if positions is None:
+            positions = np.arange(self.node_count)
+        positions = np.asarray(positions, dtype=np.int64)
+        if sizes is None:
+            sizes = self.node_size
+        nodes = []
+        rows = zip(
+            positions.tolist(),
+            self.node_id[positions].tolist(),
+            self.node_label[positions].tolist(),
+            self.node_group[positions].tolist(),
+            np.asarray(sizes)[positions].tolist(),
+        )
+        for position, node_id, label, group, size in rows:
+            node = {
+                "id": node_id,
+                "label": self.labels[label],
+                "group": self.groups[group],
+                "size": round(size, 2),
+            }
+            if collections:
+                start, end = self.collection_indptr[position : position + 2].tolist()
+                if end > start:
+                    node_collections = [
+                        self.collections[index]
+                        for index in self.collection_index[start:end].tolist()
+                    ]
+                    node["collection_ids"] = [pk for pk, _ in node_collections]
+                    node["collections"] = [
+                        {"id": pk, "label": label} for pk, label in node_collections
+                    ]
+            nodes.append(node)
+        return nodes
+
+    def link_dicts(self, positions=None):
+        if positions is None:
+            positions = np.arange(self.link_count)
+        positions = np.asarray(positions, dtype=np.int64)
+        links = []
+        rows = zip(
+            self.link_id[positions].tolist(),
+            self.link_source[positions].tolist(),
+            self.link_target[positions].tolist(),
+            self.link_type[positions].tolist(),
+        )
+        for link_id, source, target, link_type in rows:
+            label, reverse_label = self.link_types[link_type]
+            links.append(
+                {
+                    "id": link_id,
+                    "source": source,
+                    "target": target,
+                    "label": label,
+                    "reverse_label": reverse_label,
+                    "group": f"{label}|{reverse_label}",
+                }
+            )
+        return links
+
+    def to_dicts(self):
+        return self.node_dicts(), self.link_dicts()
+
+    def induced(self, node_positions, link_positions):
+        """
+        Keep only the links at `link_positions` between the nodes at
+        `node_positions`.
+        """
+        selected = np.zeros(self.node_count, dtype=bool)
+        selected[node_positions] = True
+        link_positions = np.asarray(link_positions, dtype=np.int64)
+        return link_positions[
+            self.internal_links[link_positions]
+            & selected[self.link_source_position[link_positions]]
+            & selected[self.link_target_position[link_positions]]
+        ]
+
+    def _aggregate_codes(self, by):
+        """
+        Return the code of every node when aggregating by `group` or
+        `collection`, and the `(key, label)` of every code. Nodes in
+        several collections belong to the first one, nodes without a
+        collection to the last code, whose key is None.
+        """
+        if by == "group":
+            return self.node_group.astype(np.int64), [
+                (group, group) for group in self.groups
+            ]
+        counts = np.diff(self.collection_indptr)
+        codes = np.full(self.node_count, len(self.collections), dtype=np.int64)
+        has_collection = counts > 0
+        codes[has_collection] = self.collection_index[
+            self.collection_indptr[:-1][has_collection]
+        ]
+        return codes, [
+            *((pk, label) for pk, label in self.collections),
+            (None, "No collection"),
+        ]
+
+    def aggregate_count(self, node_positions, by="group"):
+        """
+        Return the number of super-nodes `aggregate` collapses the nodes at
+        `node_positions` into.
+        """
+        codes, _ = self._aggregate_codes(by)
+        return len(np.unique(codes[np.asarray(node_positions, dtype=np.int64)]))
+
+    def aggregate(self, node_positions, link_positions, by="group"):
+        """
+        Collapse the nodes at `node_positions` into one super-node per
+        group or collection and the links at `link_positions` into one
+        link per pair of super-nodes they connect. Super-nodes carry the
+        `count` of their nodes and the `key` of their group or collection.
+        Returns the node and link dicts.
+        """
+        codes, keys = self._aggregate_codes(by)
+        node_codes = codes[np.asarray(node_positions, dtype=np.int64)]
+        counts = np.bincount(node_codes, minlength=len(keys))
+        present = np.flatnonzero(counts)
+        # super-nodes are sized relative to the median count
+        scale = max(float(np.median(counts[present])), 1) if len(present) else 1
+        sizes = node_sizes(counts[present], max_size=20, base_size=6, scale=scale)
+        nodes = [
+            {
+                "id": f"{by}:{keys[code][0]}",
+                "label": f"{keys[code][1]} ({count})",
+                "group": keys[code][1],
+                "size": size,
+                "count": count,
+                "key": keys[code][0],
+            }
+            for code, count, size in zip(
+                present.tolist(), counts[present].tolist(), sizes.tolist()
+            )
+        ]
+
+        link_positions = np.asarray(link_positions, dtype=np.int64)
+        link_positions = link_positions[self.internal_links[link_positions]]
+        sources = codes[self.link_source_position[link_positions]]
+        targets = codes[self.link_target_position[link_positions]]
+        between = sources != targets
+        pairs, link_counts = np.unique(
+            np.stack([sources[between], targets[between]], axis=1),
+            axis=0,
+            return_counts=True,
+        )
+        links = [
+            {
+                "id": f"{by}:{keys[source][0]}:{keys[target][0]}",
+                "source": f"{by}:{keys[source][0]}",
+                "target": f"{by}:{keys[target][0]}",
+                "label": f"{count} link{'s' if count != 1 else ''}",
+                "reverse_label": "",
+                "group": "aggregate",
+            }
+            for (source, target), count in zip(pairs.tolist(), link_counts.tolist())
+        ]
+        return nodes, links
+
+    def collection_ids_of(self, node_ids):
+        """
+        Return the ids of the collections of the nodes with `node_ids`.
+        """
+        positions, found = self.positions_of(np.asarray(list(node_ids), dtype=np.int64))
+        codes = gather(self.collection_indptr, self.collection_index, positions[found])
+        return {self.collections[code][0] for code in np.unique(codes).tolist()}
+
+    def take(self, node_positions, link_positions):
+        """
+        Return a graph of the nodes and links at the given positions, with
+        tables holding only the strings they use. Node positions have to
+        be in the order of the node ids.
+        """
+        node_positions = np.asarray(node_positions, dtype=np.int64)
+        link_positions = np.asarray(link_positions, dtype=np.int64)
+        counts = np.diff(self.collection_indptr)[node_positions]
+        columns = {
+            "node_id": self.node_id[node_positions],
+            "node_size": self.node_size[node_positions],
+            "collection_indptr": np.concatenate([[0], np.cumsum(counts)]),
+            "link_id": self.link_id[link_positions],
+            "link_source": self.link_source[link_positions],
+            "link_target": self.link_target[link_positions],
+        }
+        coded_columns = [
+            ("node_label", "labels", self.node_label[node_positions]),
+            ("node_group", "groups", self.node_group[node_positions]),
+            (
+                "collection_index",
+                "collections",
+                gather(self.collection_indptr, self.collection_index, node_positions),
+            ),
+            ("link_type", "link_types", self.link_type[link_positions]),
+        ]
+        for column, table, codes in coded_columns:
+            used, inverse = np.unique(codes, return_inverse=True)
+            values = getattr(self, table)
+            columns[column] = inverse.reshape(-1)
+            columns[table] = [values[code] for code in used.tolist()]
+        return type(self)(**columns)
+
+    @classmethod
+    def concatenate(cls, graphs):
+        """
+        Concatenate the nodes and links of graphs and merge their tables,
+        where the collection labels of later graphs replace earlier ones.
+        Nodes are neither sorted nor deduplicated, see `replace`.
+        """
+        tables = {name: {} for name in cls.TABLES}
+        columns = {name: [] for name in cls.ARRAYS}
+        collection_offset = 0
+        for graph in graphs:
+            codes = {}
+            for name in cls.TABLES:
+                table = tables[name]
+                table_codes = []
+                for value in getattr(graph, name):
+                    key = cls._table_key(name, value)
+                    code = table[key][0] if key in table else len(table)
+                    # later graphs win, e.g. for the label of a collection
+                    table[key] = (code, value)
+                    table_codes.append(code)
+                codes[name] = np.array(table_codes, dtype=np.int64)
+            columns["node_id"].append(graph.node_id)
+            columns["node_size"].append(graph.node_size)
+            columns["node_label"].append(codes["labels"][graph.node_label])
+            columns["node_group"].append(codes["groups"][graph.node_group])
+            columns["collection_indptr"].append(
+                graph.collection_indptr[1:] + collection_offset
+            )
+            columns["collection_index"].append(
+                codes["collections"][graph.collection_index]
+            )
+            collection_offset += len(graph.collection_index)
+            columns["link_id"].append(graph.link_id)
+            columns["link_source"].append(graph.link_source)
+            columns["link_target"].append(graph.link_target)
+            columns["link_type"].append(codes["link_types"][graph.link_type])
+        columns["collection_indptr"].insert(0, [0])
+        columns = {
+            name: np.concatenate(arrays) if arrays else ()
+            for name, arrays in columns.items()
+        }
+        for name, table in tables.items():
+            columns[name] = [value for _, value in table.values()]
+        return cls(**columns)
+
+    @staticmethod
+    def _table_key(name, value):
+        if name == "collections":
+            return value[0]
+        if name == "link_types":
+            return tuple(value)
+        return value
+
+    def replace(self, other, removed_node_ids=(), removed_link_ids=()):
+        """
+        Return a copy of the graph in which the nodes and links of `other`
+        replace the ones with the same ids, the nodes and links with the
+        ids in `removed_node_ids` and `removed_link_ids` are dropped, and so
+        are the links that lose an endpoint. Node sizes are copied as they
+        are.
+        """
+        combined = self.concatenate([self, other])
+        removed_node_ids = np.union1d(
+            np.asarray(list(removed_node_ids), dtype=np.int64), other.node_id
+        )
+        keep_nodes = np.concatenate(
+            [
+                ~np.isin(self.node_id, removed_node_ids),
+                np.ones(other.node_count, dtype=bool),
+            ]
+        )
+        node_positions = np.flatnonzero(keep_nodes)
+        node_positions = node_positions[
+            np.argsort(combined.node_id[node_positions], kind="stable")
+        ]
+
+        removed_link_ids = np.union1d(
+            np.asarray(list(removed_link_ids), dtype=np.int64), other.link_id
+        )
+        keep_links = np.concatenate(
+            [
+                ~np.isin(self.link_id, removed_link_ids),
+                np.ones(other.link_count, dtype=bool),
+            ]
+        )
+        node_ids = combined.node_id[node_positions]
+        keep_links &= np.isin(combined.link_source, node_ids)
+        keep_links &= np.isin(combined.link_target, node_ids)
+        return combined.take(node_positions, np.flatnonzero(keep_links))
+
+    def collection_shards(self, collection_ids=None):
+        """
+        Split the graph into one graph per collection, holding the nodes
+        of the collection and every link touching one of them, so that
+        shards can be merged without losing the links between them. Pass
+        `collection_ids` to only split off some collections. Returns the
+        shards by collection id.
+        """
+        members = np.repeat(np.arange(self.node_count), np.diff(self.collection_indptr))
+        indptr, positions = group_positions(
+            self.collection_index, len(self.collections)
+        )
+        shards = {}
+        for code, (collection_id, _) in enumerate(self.collections):
+            if collection_ids is not None and collection_id not in collection_ids:
+                continue
+            node_positions = members[positions[indptr[code] : indptr[code + 1]]]
+            if len(node_positions):
+                link_positions = np.unique(gather(*self.incident_links, node_positions))
+                shards[collection_id] = self.take(node_positions, link_positions)
+        return shards
+
+    @classmethod
+    def merge(cls, graphs):
+        """
+        Merge graphs into one, keeping only the links whose endpoints are
+        both part of it. Nodes and links that are part of several graphs
+        are taken from the first one.
+        """
+        combined = cls.concatenate(graphs)
+        # the first position of every id, nodes sorted by their id
+        _, node_positions = np.unique(combined.node_id, return_index=True)
+        _, link_positions = np.unique(combined.link_id, return_index=True)
+        link_positions = np.sort(link_positions)
+        node_ids = combined.node_id[node_positions]
+        link_positions = link_positions[
+            np.isin(combined.link_source[link_positions], node_ids)
+            & np.isin(combined.link_target[link_positions], node_ids)
+        ]
+        return combined.take(node_positions, link_positions)
+
+
+class SubstringIndex:
+    """
+    Inverted index answering `query in text` for a set of texts.
+    Every distinct text is split into all its n-grams up to `NGRAM_SIZE`
+    characters. Queries that are not longer than that are a single
+    lookup, longer ones intersect the posting lists of their n-grams and
+    only check the few remaining candidate texts.
+    Pass the index of a `previous` version of the texts to reuse the
+    n-grams of the texts that did not change. The texts that are gone
+    stay in the postings until they outnumber the others.
+    """
+
+    NGRAM_SIZE = 3
+
+    def __init__(self, previous=None):
+        self._items_by_text = {}
+        self._texts = []
+        self._text_ids = {}
+        self._postings = {}
+        if previous is not None and previous.stale_count <= len(
+            previous._items_by_text
+        ):
+            self._texts = list(previous._texts)
+            self._text_ids = dict(previous._text_ids)
+            self._postings = {
+                gram: list(text_ids) for gram, text_ids in previous._postings.items()
+            }
+
+    @property
+    def stale_count(self):
+        """
+        The number of indexed texts without items.
+        """
+        return len(self._texts) - len(self._items_by_text)
+
+    def add(self, text, items):
+        text = str(text).lower()
+        if not text or not len(items):
+            return
+        text_items = self._items_by_text.get(text)
+        if text_items is None:
+            text_items = self._items_by_text[text] = []
+            if text not in self._text_ids:
+                self._index_text(text)
+        text_items.append(np.asarray(items, dtype=np.int64))
+
+    def _index_text(self, text):
+        text_id = self._text_ids[text] = len(self._texts)
+        self._texts.append(text)
+        grams = {
+            text[start : start + size]
+            for size in range(1, self.NGRAM_SIZE + 1)
+            for start in range(len(text) - size + 1)
+        }
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(text_id)
+
+    def search(self, query):
+        """
+        Return the sorted items of all texts containing `query`.
+        """
+        query = query.lower()
+        if len(query) <= self.NGRAM_SIZE:
+            text_ids = self._postings.get(query, [])
+        else:
+            grams = {
+                query[start : start + self.NGRAM_SIZE]
+                for start in range(len(query) - self.NGRAM_SIZE + 1)
+            }
+            postings = sorted(
+                (self._postings.get(gram, []) for gram in grams), key=len
+            )
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    break
+            text_ids = [
+                text_id for text_id in candidates if query in self._texts[text_id]
+            ]
+
+        items = [
+            text_items
+            for text_id in text_ids
+            for text_items in self._items_by_text.get(self._texts[text_id], ())
+        ]
+        if not items:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(items))
+
+
+class GraphSearchIndex:
+    """
+    Search index over the labels, groups and collections of the nodes and
+    the labels of the links of a graph. Search results are node and link
+    positions in the `GraphData` the index was built from, `filter` leaves
+    out links to nodes outside of it. Pass the index of a `previous`
+    version of the graph to reuse the n-grams of its texts.
+    """
+
+    def __init__(self, graph, previous=None):
+        self.graph = graph
+        self._node_index = SubstringIndex(previous and previous._node_index)
+        self._link_index = SubstringIndex(previous and previous._link_index)
+
+        indptr, positions = group_positions(graph.node_label, len(graph.labels))
+        for code, text in enumerate(graph.labels):
+            self._node_index.add(text, positions[indptr[code] : indptr[code + 1]])
+
+        indptr, positions = group_positions(graph.node_group, len(graph.groups))
+        for code, text in enumerate(graph.groups):
+            self._node_index.add(text, positions[indptr[code] : indptr[code + 1]])
+
+        collection_nodes = np.repeat(
+            np.arange(graph.node_count), np.diff(graph.collection_indptr)
+        )
+        indptr, positions = group_positions(
+            graph.collection_index, len(graph.collections)
+        )
+        for code, (_, text) in enumerate(graph.collections):
+            self._node_index.add(
+                text, collection_nodes[positions[indptr[code] : indptr[code + 1]]]
+            )
+
+        indptr, positions = group_positions(graph.link_type, len(graph.link_types))
+        for code, (label, reverse_label) in enumerate(graph.link_types):
+            link_positions = positions[indptr[code] : indptr[code + 1]]
+            for text in (label, reverse_label, f"{label}|{reverse_label}"):
+                self._link_index.add(text, link_positions)
+
+    def search(self, query):
+        """
+        Return the positions of the nodes and links matching `query`. A
+        numeric query also matches the node with that id.
+        """
+        node_positions = self._node_index.search(query)
+        # `isdigit` is also true for digits `int` does not accept, like "²"
+        if (
+            query.isascii()
+            and query.isdigit()
+            and int(query) in self.graph.node_positions
+        ):
+            node_positions = np.union1d(
+                node_positions, [self.graph.node_positions[int(query)]]
+            )
+        return node_positions, self._link_index.search(query)
+
+    def filter(self, query):
+        """
+        Return the sorted positions of the nodes and links to show for
+        `query`: all matching nodes and links, the links of the matching
+        nodes and the nodes at the ends of those links.
+        """
+        node_positions, link_positions = self.search(query)
+        # the nodes of both ends of the matching links are shown
+        link_positions = link_positions[self.graph.internal_links[link_positions]]
+        if not len(node_positions) and not len(link_positions):
+            return node_positions, link_positions
+
+        link_positions = np.union1d(
+            link_positions,
+            gather(*self.graph.incident_links, node_positions),
+        )
+        node_positions = np.union1d(
+            node_positions,
+            np.concatenate(
+                [
+                    self.graph.link_source_position[link_positions],
+                    self.graph.link_target_position[link_positions],
+                ]
+            ),
+        )
+        return node_positions, link_positions
+
+
+class LRUCache:
+    """
+    A thread safe mapping holding at most `maxsize` entries, dropping the
+    least recently used ones first.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_version(self, key, version, default=None):
+        """
+        Return the value stored for `key` by `set_version`, or `default` if
+        it was stored for another version.
+        """
+        entry = self.get(key)
+        if entry is None or entry[0] != version:
+            return default
+        return entry[1]
+
+    def set_version(self, key, version, value):
+        """
+        Store the `value` of `key` at `version`, replacing the value of any
+        other version.
+        """
+        self.set(key, (version, value))
+
+    def discard_where(self, predicate):
+        """
+        Drop the entries for which `predicate(key, value)` is true.
+        """
+        with self._lock:
+            discarded = [
+                key for key, value in self._data.items() if predicate(key, value)
+            ]
+            for key in discarded:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -1,13 +1,26 @@
 """
 This module contains utility functions for working with Hiri dates
 (ref: https://www.muslimphilosophy.com/ip/hijri.htm)
+
+Conversions of the years in `HIJRI_TABLE_YEARS` are looked up in a table
+of the Gregorian dates of every day of these years, which is built on
+first use. Dates outside of it are calculated.
 """
 
 from datetime import datetime
+from functools import lru_cache
 from typing import Tuple
 
+import numpy as np
 from django_interval.utils import DateTuple
 
+# the first and last hijri year of the conversion table, year 0 is part of
+# it because the first century starts there
+HIJRI_TABLE_YEARS = (0, 1500)
+
+# julian day from which on the gregorian calendar is used (1582-10-15)
+GREGORIAN_REFORM_JULIAN_DAY = 2299161
+
 
 def _last_day_of_hijri_year(hijri_year):
     is_leap_year = (11 * hijri_year + 14) % 30 == 0
@@ -71,36 +84,225 @@ def hijri_to_gregorian(hijri_year, hijri_month, hijri_day):
     """
     source: islToChr in https://www.muslimphilosophy.com/ip/hijri.htm
     """
-    jd = (
-        int((11 * hijri_year + 3) / 30)
+    table = _hijri_table()
+    ordinal = table.ordinal(hijri_year, hijri_month, hijri_day)
+    if ordinal:
+        return datetime.fromordinal(ordinal)
+    # outside of the table, or a julian date that does not exist in the
+    # proleptic gregorian calendar of `datetime`, which raises here
+    julian_day = _hijri_julian_day(hijri_year, hijri_month, hijri_day)
+    return datetime(*_julian_day_to_date(julian_day))
+
+
+def hijri_to_gregorian_array(hijri_years, hijri_months, hijri_days) -> np.ndarray:
+    """
+    Convert whole columns of hijri dates at once, see `hijri_to_gregorian`.
+    Returns a `datetime64[D]` array, dates that `datetime` can not
+    represent are `NaT`.
+    """
+    hijri_years, hijri_months, hijri_days = np.broadcast_arrays(
+        np.asarray(hijri_years, dtype=np.int64),
+        np.asarray(hijri_months, dtype=np.int64),
+        np.asarray(hijri_days, dtype=np.int64),
+    )
+    table = _hijri_table()
+    julian_days = _hijri_julian_day(hijri_years, hijri_months, hijri_days)
+    index = julian_days - table.first_julian_day
+    in_table = (
+        (hijri_months >= 1)
+        & (hijri_months <= 12)
+        & (index >= 0)
+        & (index < len(table.ordinals))
+    )
+    ordinals = np.zeros(julian_days.shape, dtype=np.int64)
+    ordinals[in_table] = table.ordinals[index[in_table]]
+    if not in_table.all():
+        ordinals[~in_table] = _date_to_ordinal(
+            *_julian_day_to_date(julian_days[~in_table])
+        )
+    return _ordinal_to_datetime64(ordinals)
+
+
+def gregorian_to_hijri_array(dates) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert a column of dates back to hijri years, months and days, the
+    inverse of `hijri_to_gregorian_array`. Like there, dates before the
+    gregorian reform are read as dates of the julian calendar.
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if np.isnat(dates).any():
+        raise ValueError("Can not convert missing dates to hijri dates")
+    months = dates.astype("datetime64[M]")
+    years = months.astype(np.int64) // 12 + 1970
+    days = (dates - months).astype(np.int64) + 1
+    months = months.astype(np.int64) % 12 + 1
+    return _julian_day_to_hijri(_date_to_julian_day(years, months, days))
+
+
+def hijri_year_histogram(queryset, field="date_date_sort", bucket_size=1):
+    """
+    Count the records of `queryset` per hijri year of the date `field`, or
+    per `bucket_size` years, e.g. 10 for decades. Centuries start with the
+    year 0 like in the parser. Returns the first year of every bucket with
+    its count, sorted by year; records without a date are left out.
+    """
+    dates = queryset.filter(**{f"{field}__isnull": False}).values_list(
+        field, flat=True
+    )
+    dates = np.array(list(dates), dtype="datetime64[D]")
+    years, _, _ = gregorian_to_hijri_array(dates)
+    buckets, counts = np.unique(years // bucket_size * bucket_size, return_counts=True)
+    return dict(zip(buckets.tolist(), counts.tolist()))
+
+
+class _HijriTable:
+    """
+    The proleptic gregorian ordinal of every day of the hijri years
+    `first_year` to `last_year`, 0 where the date does not exist in the
+    gregorian calendar, and the julian day of the first day of every month.
+    """
+
+    def __init__(self, first_year, last_year):
+        self.first_year = first_year
+        years = np.arange(first_year, last_year + 1)[:, np.newaxis]
+        months = np.arange(1, 13)[np.newaxis, :]
+        month_starts = _hijri_julian_day(years, months, 1)
+        self.first_julian_day = int(month_starts[0, 0])
+        self.month_starts = month_starts.tolist()
+        julian_days = np.arange(
+            self.first_julian_day, _hijri_julian_day(last_year, 12, 30) + 1
+        )
+        ordinals = _date_to_ordinal(*_julian_day_to_date(julian_days))
+        self.ordinals = ordinals.astype(np.int32)
+        # indexing a memoryview gives python ints without numpy's overhead
+        self._ordinals_view = memoryview(self.ordinals)
+
+    def ordinal(self, hijri_year, hijri_month, hijri_day):
+        row = hijri_year - self.first_year
+        if not (0 <= row < len(self.month_starts) and 1 <= hijri_month <= 12):
+            return 0
+        index = self.month_starts[row][hijri_month - 1] + hijri_day - 1
+        index -= self.first_julian_day
+        if not 0 <= index < len(self.ordinals):
+            return 0
+        return self._ordinals_view[index]
+
+
+@lru_cache(maxsize=None)
+def _hijri_table():
+    return _HijriTable(*HIJRI_TABLE_YEARS)
+
+
+def _int_div(a, b):
+    """
+    Division truncated towards zero like `int(a / b)`, for numbers and
+    integer arrays.
+    """
+    if isinstance(a, np.ndarray):
+        return np.sign(a) * (np.abs(a) // b)
+    return int(a / b)
+
+
+def _hijri_julian_day(hijri_year, hijri_month, hijri_day):
+    return (
+        _int_div(11 * hijri_year + 3, 30)
         + 354 * hijri_year
         + 30 * hijri_month
-        - int((hijri_month - 1) / 2)
+        - _int_div(hijri_month - 1, 2)
         + hijri_day
         + 1948440
         - 385
     )
-    if jd > 2299160:
-        l = jd + 68569
-        n = int((4 * l) / 146097)
-        l = l - int((146097 * n + 3) / 4)
-        i = int((4000 * (l + 1)) / 1461001)
-        l = l - int((1461 * i) / 4) + 31
-        j = int((80 * l) / 2447)
-        d = l - int((2447 * j) / 80)
-        l = int(j / 11)
-        m = j + 2 - 12 * l
-        y = 100 * (n - 49) + i + l
-    else:
-        j = jd + 1402
-        k = int((j - 1) / 1461)
-        l = j - 1461 * k
-        n = int((l - 1) / 365) - int(l / 1461)
-        i = l - 365 * n + 30
-        j = int((80 * i) / 2447)
-        d = i - int((2447 * j) / 80)
-        i = int(j / 11)
-        m = j + 2 - 12 * i
-        y = 4 * k + n + i - 4716
-
-    return datetime(y, m, d)
+
+
+def _julian_day_to_date(jd):
+    """
+    Year, month and day of a julian day, in the julian calendar before the
+    gregorian reform. Works on numbers and integer arrays.
+    """
+    if not isinstance(jd, np.ndarray):
+        return tuple(int(value[0]) for value in _julian_day_to_date(np.array([jd])))
+    gregorian = jd >= GREGORIAN_REFORM_JULIAN_DAY
+
+    l = jd + 68569
+    n = _int_div(4 * l, 146097)
+    l = l - _int_div(146097 * n + 3, 4)
+    i = _int_div(4000 * (l + 1), 1461001)
+    l = l - _int_div(1461 * i, 4) + 31
+    j = _int_div(80 * l, 2447)
+    gregorian_d = l - _int_div(2447 * j, 80)
+    l = _int_div(j, 11)
+    gregorian_m = j + 2 - 12 * l
+    gregorian_y = 100 * (n - 49) + i + l
+
+    j = jd + 1402
+    k = _int_div(j - 1, 1461)
+    l = j - 1461 * k
+    n = _int_div(l - 1, 365) - _int_div(l, 1461)
+    i = l - 365 * n + 30
+    j = _int_div(80 * i, 2447)
+    julian_d = i - _int_div(2447 * j, 80)
+    i = _int_div(j, 11)
+    julian_m = j + 2 - 12 * i
+    julian_y = 4 * k + n + i - 4716
+
+    return (
+        np.where(gregorian, gregorian_y, julian_y),
+        np.where(gregorian, gregorian_m, julian_m),
+        np.where(gregorian, gregorian_d, julian_d),
+    )
+
+
+# days from the start of a hijri year to the start of each of its months
+_HIJRI_MONTH_OFFSETS = np.array([30 * month - month // 2 for month in range(12)])
+
+
+def _julian_day_to_hijri(julian_days):
+    # a hijri year is 10631 / 30 days long on average and its start differs
+    # at most a day from that, so the estimate is off by at most one year
+    year_zero = _hijri_julian_day(0, 1, 1)
+    years = (julian_days - year_zero) * 30 // 10631
+    years -= julian_days < _hijri_julian_day(years, 1, 1)
+    years += julian_days >= _hijri_julian_day(years + 1, 1, 1)
+    offsets = julian_days - _hijri_julian_day(years, 1, 1)
+    months = np.searchsorted(_HIJRI_MONTH_OFFSETS, offsets, side="right")
+    days = offsets - _HIJRI_MONTH_OFFSETS[months - 1] + 1
+    return years, months, days
+
+
+def _date_to_julian_day(years, months, days):
+    """
+    The julian day of dates given as integer arrays, read in the julian
+    calendar before the gregorian reform like `_julian_day_to_date` returns
+    them.
+    """
+    a = (14 - months) // 12
+    y = years + 4800 - a
+    m = months + 12 * a - 3
+    julian_days = days + (153 * m + 2) // 5 + 365 * y + y // 4 - 32083
+    gregorian_days = julian_days - y // 100 + y // 400 + 38
+    gregorian = gregorian_days >= GREGORIAN_REFORM_JULIAN_DAY
+    return np.where(gregorian, gregorian_days, julian_days)
+
+
+def _date_to_ordinal(years, months, days):
+    """
+    The proleptic gregorian ordinals of dates given as integer arrays, 0
+    for dates `datetime` can not represent.
+    """
+    months = (years - 1970) * 12 + months - 1
+    month_starts = months.astype("datetime64[M]").astype("datetime64[D]")
+    month_lengths = (months + 1).astype("datetime64[M]").astype("datetime64[D]")
+    month_lengths = (month_lengths - month_starts).astype(np.int64)
+    valid = (years >= 1) & (years <= 9999) & (days >= 1) & (days <= month_lengths)
+    ordinals = month_starts.astype(np.int64) + days - 1 + _EPOCH_ORDINAL
+    return np.where(valid, ordinals, 0)
+
+
+def _ordinal_to_datetime64(ordinals):
+    dates = (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+    dates[ordinals == 0] = np.datetime64("NaT", "D")
+    return dates
+
+
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
@@ -0,0 +1,140 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from apis_ontology.graph_utils import GraphData, GraphSearchIndex, node_sizes
+
+WORDS = [
+    "masjid", "jami", "minaret", "madrasa", "mausoleum", "herat", "balkh",
+    "nishapur", "merv", "ghazni", "sultan", "amir", "ibn", "abu", "al-din",
+    "husayn", "mahmud", "tile", "stucco", "brick", "wood", "panel", "frieze",
+]
+GROUPS = ["person", "inscription", "monument", "object", "place", "illustration", "work"]
+RELATIONS = [
+    ("person mentioned in", "mentions"),
+    ("found in object", "object contains"),
+    ("object part of monument", "contains"),
+    ("monument located in", "contains"),
+    ("parent of", "child of"),
+]
+
+
+def synthetic_graph(node_count, link_count, seed=0):
+    rng = random.Random(seed)
+    nodes = [
+        {
+            "id": node_id,
+            "label": " ".join(rng.choices(WORDS, k=rng.randint(1, 4))),
+            "group": rng.choice(GROUPS),
+        }
+        for node_id in range(1, node_count + 1)
+    ]
+    links = []
+    for link_id in range(1, link_count + 1):
+        label, reverse_label = rng.choice(RELATIONS)
+        links.append(
+            {
+                "id": link_id,
+                "source": rng.randint(1, node_count),
+                "target": rng.randint(1, node_count),
+                "label": label,
+                "reverse_label": reverse_label,
+                "group": f"{label}|{reverse_label}",
+            }
+        )
+    return nodes, links
+
+
+def naive_filter(nodes, links, query):
+    """
+    The filter GraphView used before the search index, kept as a baseline.
+    """
+
+    def matches_query(value):
+        if isinstance(value, dict):
+            return any(matches_query(v) for v in value.values())
+        if isinstance(value, (list, tuple, set)):
+            return any(matches_query(v) for v in value)
+        return query in str(value).lower()
+
+    matching_nodes = [node for node in nodes if matches_query(node)]
+    matching_node_ids = {node.get("id") for node in matching_nodes}
+    matching_links = [link for link in links if matches_query(link)]
+    links_of_matching_nodes = [
+        link
+        for link in links
+        if link.get("source") in matching_node_ids
+        or link.get("target") in matching_node_ids
+    ]
+    if not matching_node_ids and not matching_links:
+        return [], []
+
+    filtered_links = []
+    seen_links = set()
+    for link in matching_links + links_of_matching_nodes:
+        key = json.dumps(link, sort_keys=True, default=str)
+        if key in seen_links:
+            continue
+        seen_links.add(key)
+        filtered_links.append(link)
+
+    visible_node_ids = set()
+    for link in filtered_links:
+        visible_node_ids.add(link.get("source"))
+        visible_node_ids.add(link.get("target"))
+
+    filtered_nodes = list(matching_nodes)
+    for node in nodes:
+        if node.get("id") in visible_node_ids and node not in filtered_nodes:
+            filtered_nodes.append(node)
+
+    return filtered_nodes, filtered_links
+
+
+class Command(BaseCommand):
+    help = "Benchmark GraphView search filtering on a synthetic graph snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nodes", type=int, default=50000)
+        parser.add_argument("--links", type=int, default=200000)
+        parser.add_argument(
+            "--query",
+            action="append",
+            dest="queries",
+            help="query to benchmark, can be given several times",
+        )
+        parser.add_argument(
+            "--naive",
+            action="store_true",
+            help="also time the previous list based filter (slow for broad queries)",
+        )
+
+    def timed(self, label, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(f"{label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        return result
+
+    def handle(self, *args, **options):
+        nodes, links = synthetic_graph(options["nodes"], options["links"])
+        self.stdout.write(
+            f"Synthetic snapshot with {len(nodes)} nodes and {len(links)} links"
+        )
+        graph = self.timed("encode snapshot", GraphData.from_dicts, nodes, links)
+        index = self.timed("build search index", GraphSearchIndex, graph)
+
+        for query in options["queries"] or ["ghazni", "al-din husayn", "parent", "a"]:
+            node_positions, link_positions = self.timed(
+                f"indexed filter {query!r}", index.filter, query
+            )
+            self.stdout.write(
+                f"  {len(node_positions)} nodes / {len(link_positions)} links"
+            )
+            self.timed(
+                f"resize filtered nodes {query!r}",
+                lambda: node_sizes(graph.degrees(link_positions)),
+            )
+            if options["naive"]:
+                self.timed(f"naive filter {query!r}", naive_filter, nodes, links, query)
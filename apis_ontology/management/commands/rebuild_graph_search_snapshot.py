@@ -6,8 +6,40 @@ from apis_ontology.models import GraphSearchSnapshot
 class Command(BaseCommand):
     help = "Rebuild the denormalized graph snapshot used by GraphView"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--wait",
+            action="store_true",
+            help="wait for a rebuild that is already running and rebuild afterwards",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="rebuild even if another rebuild holds the lock",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="number of processes building the nodes and links of the models in parallel",
+        )
+
     def handle(self, *args, **options):
-        snapshot = GraphSearchSnapshot.rebuild()
+        rebuilt = GraphSearchSnapshot.schedule_rebuild(
+            background=False,
+            wait=options["wait"],
+            force=options["force"],
+            workers=options["workers"],
+        )
+        if not rebuilt:
+            self.stdout.write(
+                self.style.WARNING(
+                    "Another graph snapshot rebuild is running, use --wait or --force"
+                )
+            )
+            return
+
+        snapshot = GraphSearchSnapshot.objects.get(key=GraphSearchSnapshot.DEFAULT_KEY)
         self.stdout.write(
             self.style.SUCCESS(
                 f"Rebuilt graph snapshot with {snapshot.node_count} nodes and {snapshot.link_count} links"
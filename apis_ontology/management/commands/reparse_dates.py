@@ -0,0 +1,119 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from apis_ontology.date_utils import parse_dates
+from apis_ontology.fields import (
+    STATE_SUFFIXES,
+    TrackedFuzzyDateParserField,
+    parse_state,
+)
+
+DERIVED_SUFFIXES = ["_date_sort", "_date_from", "_date_to"]
+SUFFIXES = DERIVED_SUFFIXES + STATE_SUFFIXES
+
+
+def date_fields(model):
+    return [
+        field.name
+        for field in model._meta.concrete_fields
+        if isinstance(field, TrackedFuzzyDateParserField)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-derive the stored dates of all fuzzy date fields that were changed "
+        "or parsed with an older grammar version"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="number of processes parsing large batches of date strings",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="also reparse the dates parsed with the current grammar version",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only report how many records would change",
+        )
+
+    def iter_models(self):
+        for model in apps.get_app_config("apis_ontology").get_models():
+            # the versions of django-simple-history keep the dates of the past
+            if any(field.name == "history_id" for field in model._meta.fields):
+                continue
+            if fields := date_fields(model):
+                yield model, fields
+
+    def handle(self, *args, **options):
+        for model, fields in self.iter_models():
+            columns = [f"{field}{suffix}" for field in fields for suffix in SUFFIXES]
+            rows = list(model.objects.values_list("pk", *fields, *columns))
+
+            # the stored state tells which dates are still up to date
+            pending = []
+            for offset, row in enumerate(rows):
+                for position in range(len(fields)):
+                    state = 1 + len(fields) + position * len(SUFFIXES)
+                    state += len(DERIVED_SUFFIXES)
+                    # normalized form and grammar version
+                    stored = row[state : state + 2]
+                    if options["all"] or stored != parse_state(row[1 + position])[:2]:
+                        pending.append((offset, position))
+            # all fields of the model are parsed as one batch
+            parsed = parse_dates(
+                [rows[offset][1 + position] for offset, position in pending],
+                workers=options["workers"],
+            )
+            derived = [
+                parsed.sort_date.astype(object),
+                parsed.from_date.astype(object),
+                parsed.to_date.astype(object),
+            ]
+
+            values = {}
+            failed = 0
+            for index, (offset, position) in enumerate(pending):
+                row = rows[offset]
+                row_values = values.setdefault(offset, list(row[1 + len(fields) :]))
+                start = position * len(SUFFIXES)
+                if parsed.failed[index]:
+                    # keep the stored dates, saving the record would fail
+                    failed += 1
+                else:
+                    row_values[start : start + len(DERIVED_SUFFIXES)] = [
+                        dates[index] for dates in derived
+                    ]
+                row_values[start + len(DERIVED_SUFFIXES) : start + len(SUFFIXES)] = (
+                    parse_state(row[1 + position], failed=parsed.failed[index])
+                )
+            changed = [
+                model(pk=rows[offset][0], **dict(zip(columns, row_values)))
+                for offset, row_values in values.items()
+                if row_values != list(rows[offset][1 + len(fields) :])
+            ]
+
+            if changed and not options["dry_run"]:
+                # only the derived columns are written, the others are not loaded
+                model.objects.bulk_update(
+                    changed, columns, batch_size=options["batch_size"]
+                )
+            self.stdout.write(
+                f"{model._meta.label}: {len(pending)} dates reparsed, "
+                f"{len(changed)} of {len(rows)} records "
+                f"{'would change' if options['dry_run'] else 'updated'}"
+            )
+            if failed:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{model._meta.label}: {failed} dates could not be parsed"
+                    )
+                )
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+def delete_snapshots(apps, schema_editor):
+    # snapshots are rebuilt in the new format on their first use
+    GraphSearchSnapshot = apps.get_model("apis_ontology", "GraphSearchSnapshot")
+    GraphSearchSnapshot.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apis_ontology", "0035_graphsearchsnapshot"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_snapshots, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="graphsearchsnapshot",
+            name="links",
+        ),
+        migrations.RemoveField(
+            model_name="graphsearchsnapshot",
+            name="nodes",
+        ),
+        migrations.AddField(
+            model_name="graphsearchsnapshot",
+            name="data",
+            field=models.BinaryField(blank=True, default=bytes),
+        ),
+    ]
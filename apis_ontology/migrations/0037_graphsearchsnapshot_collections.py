@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+def delete_snapshots(apps, schema_editor):
+    # snapshots are rebuilt with their collections on their first use
+    GraphSearchSnapshot = apps.get_model("apis_ontology", "GraphSearchSnapshot")
+    GraphSearchSnapshot.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apis_ontology", "0036_graphsearchsnapshot_data"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_snapshots, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="graphsearchsnapshot",
+            name="collections",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
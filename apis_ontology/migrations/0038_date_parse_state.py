@@ -0,0 +1,212 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:37
+
+import apis_ontology.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apis_ontology", "0037_graphsearchsnapshot_collections"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="inscription",
+            name="date_date_grammar_version",
+            field=models.PositiveSmallIntegerField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="inscription",
+            name="date_date_normalized",
+            field=models.TextField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="inscription",
+            name="date_date_parse_status",
+            field=models.CharField(
+                auto_created=True,
+                blank=True,
+                choices=[("parsed", "Parsed"), ("failed", "Failed")],
+                editable=False,
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="active_years_end_date_grammar_version",
+            field=models.PositiveSmallIntegerField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="active_years_end_date_normalized",
+            field=models.TextField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="active_years_end_date_parse_status",
+            field=models.CharField(
+                auto_created=True,
+                blank=True,
+                choices=[("parsed", "Parsed"), ("failed", "Failed")],
+                editable=False,
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="active_years_start_date_grammar_version",
+            field=models.PositiveSmallIntegerField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="active_years_start_date_normalized",
+            field=models.TextField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="active_years_start_date_parse_status",
+            field=models.CharField(
+                auto_created=True,
+                blank=True,
+                choices=[("parsed", "Parsed"), ("failed", "Failed")],
+                editable=False,
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="versioninscription",
+            name="date_date_grammar_version",
+            field=models.PositiveSmallIntegerField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="versioninscription",
+            name="date_date_normalized",
+            field=models.TextField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="versioninscription",
+            name="date_date_parse_status",
+            field=models.CharField(
+                auto_created=True,
+                blank=True,
+                choices=[("parsed", "Parsed"), ("failed", "Failed")],
+                editable=False,
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionperson",
+            name="active_years_end_date_grammar_version",
+            field=models.PositiveSmallIntegerField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionperson",
+            name="active_years_end_date_normalized",
+            field=models.TextField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionperson",
+            name="active_years_end_date_parse_status",
+            field=models.CharField(
+                auto_created=True,
+                blank=True,
+                choices=[("parsed", "Parsed"), ("failed", "Failed")],
+                editable=False,
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionperson",
+            name="active_years_start_date_grammar_version",
+            field=models.PositiveSmallIntegerField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionperson",
+            name="active_years_start_date_normalized",
+            field=models.TextField(
+                auto_created=True, blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionperson",
+            name="active_years_start_date_parse_status",
+            field=models.CharField(
+                auto_created=True,
+                blank=True,
+                choices=[("parsed", "Parsed"), ("failed", "Failed")],
+                editable=False,
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="inscription",
+            name="date",
+            field=apis_ontology.fields.TrackedFuzzyDateParserField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="person",
+            name="active_years_end",
+            field=apis_ontology.fields.TrackedFuzzyDateParserField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="person",
+            name="active_years_start",
+            field=apis_ontology.fields.TrackedFuzzyDateParserField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="versioninscription",
+            name="date",
+            field=apis_ontology.fields.TrackedFuzzyDateParserField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="versionperson",
+            name="active_years_end",
+            field=apis_ontology.fields.TrackedFuzzyDateParserField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="versionperson",
+            name="active_years_start",
+            field=apis_ontology.fields.TrackedFuzzyDateParserField(
+                blank=True, null=True
+            ),
+        ),
+    ]
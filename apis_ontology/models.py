@@ -1,36 +1,52 @@
 import logging
-import math
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.apps import apps
 from django.core.cache import cache
-from django.db import models
+from django.db import connections, models, transaction
 from apis_core.apis_entities.abc import (
     E21_Person,
     E53_Place,
     SimpleLabelModel,
 )
 from apis_core.apis_entities.models import AbstractEntity
-from apis_core.collections.models import SkosCollectionContentObject
+from apis_core.collections.models import SkosCollection, SkosCollectionContentObject
 from apis_core.generic.abc import GenericModel
 from apis_core.history.models import VersionMixin
 from apis_core.relations.models import Relation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django_interval.fields import FuzzyDateParserField
+from .fields import TrackedFuzzyDateParserField
 
 from .date_utils import nomansland_dateparser
+from .graph_utils import GraphData, LRUCache, count_degrees, node_sizes
 from auditlog.registry import auditlog
+from django.utils.encoding import force_str
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 
 logger = logging.getLogger(__name__)
 
+# the latest decoded version of every snapshot key in this process
+_decoded_snapshots = LRUCache(maxsize=32)
+
 
 class IADateMixin(models.Model):
     class Meta:
         abstract = True
 
-    start = FuzzyDateParserField(parser=nomansland_dateparser, null=True, blank=True)
-    end = FuzzyDateParserField(parser=nomansland_dateparser, null=True, blank=True)
+    start = TrackedFuzzyDateParserField(
+        parser=nomansland_dateparser, null=True, blank=True
+    )
+    end = TrackedFuzzyDateParserField(
+        parser=nomansland_dateparser, null=True, blank=True
+    )
 
 
 class VocabularyBaseModel(GenericModel, SimpleLabelModel):
@@ -229,7 +245,9 @@ class Inscription(IABaseModel, PreservationStateMixin):
     text_transliteration = models.TextField(blank=True, null=True)
     text_translation = models.TextField(blank=True, null=True)
     remarks = models.TextField(blank=True, null=True, verbose_name="remarks on text")
-    date = FuzzyDateParserField(parser=nomansland_dateparser, null=True, blank=True)
+    date = TrackedFuzzyDateParserField(
+        parser=nomansland_dateparser, null=True, blank=True
+    )
     remarks_on_date = models.TextField(blank=True, null=True)
     comparisons = models.TextField(blank=True, null=True)
 
@@ -291,11 +309,11 @@ class Person(E21_Person, PersonMixin, IABaseModel):
         null=True,
         help_text="If not provided, the name will be generated from the name parts.",
     )
-    active_years_start = FuzzyDateParserField(
+    active_years_start = TrackedFuzzyDateParserField(
         parser=nomansland_dateparser, null=True, blank=True
     )
     date_of_birth = None
-    active_years_end = FuzzyDateParserField(
+    active_years_end = TrackedFuzzyDateParserField(
         parser=nomansland_dateparser, null=True, blank=True
     )
     date_of_death = None
@@ -722,15 +740,189 @@ class MonumentConnectedToMonument(IARelationMixin):
         return "monument connected to"
 
 
+class GraphLabelResolver:
+    """
+    Compute the labels of entities the way their `__str__` methods do, but
+    for whole models at once: every model needs a handful of queries
+    instead of several queries per object. Labels that are needed to build
+    other labels (places for monuments, monuments for objects, ...) are
+    computed once and reused.
+    Pass `ids` to restrict the computation to some objects, otherwise the
+    whole table is labelled.
+    """
+
+    def __init__(self):
+        self._labels = {}
+        self._complete = set()
+
+    def labels(self, model, ids=None):
+        cached = self._labels.setdefault(model, {})
+        if model not in self._complete:
+            if ids is None:
+                cached.update(self._compute(model, None))
+                self._complete.add(model)
+            else:
+                missing = set(ids) - cached.keys()
+                if missing:
+                    cached.update(self._compute(model, missing))
+        if ids is None:
+            return cached
+        return {pk: cached[pk] for pk in ids if pk in cached}
+
+    def _compute(self, model, ids):
+        queryset = model.objects.all()
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        compute = getattr(self, f"_{model._meta.model_name}_labels", None)
+        if compute is None:
+            return {obj.pk: str(obj) for obj in queryset.iterator(chunk_size=5000)}
+        return compute(queryset, ids)
+
+    @staticmethod
+    def _default_label(model, pk):
+        # the label of `models.Model.__str__`
+        return f"{model.__name__} object ({pk})"
+
+    @staticmethod
+    def _related_ids(relation, source_field, target_field, ids):
+        queryset = relation.objects.exclude(**{f"{target_field}__isnull": True})
+        if ids is not None:
+            queryset = queryset.filter(**{f"{source_field}__in": ids})
+        related = {}
+        for source_id, target_id in queryset.values_list(source_field, target_field):
+            related.setdefault(source_id, []).append(target_id)
+        return related
+
+    def _first_related_labels(self, relation, source_field, target_field, model, ids):
+        """
+        Map the ids of the source entities to the label of the first entity
+        of `model` they are related to via `relation`, like `.first()` does.
+        """
+        related = self._related_ids(relation, source_field, target_field, ids)
+        target_ids = None
+        if ids is not None:
+            target_ids = {pk for targets in related.values() for pk in targets}
+        labels = self.labels(model, target_ids)
+
+        key = None
+        if model._meta.ordering:
+            ordered = model.objects.all()
+            if target_ids is not None:
+                ordered = ordered.filter(pk__in=target_ids)
+            rank = {pk: i for i, pk in enumerate(ordered.values_list("id", flat=True))}
+            key = rank.get
+
+        first_labels = {}
+        for source_id, targets in related.items():
+            targets = [pk for pk in targets if pk in labels]
+            if targets:
+                first_labels[source_id] = labels[min(targets, key=key)]
+        return first_labels
+
+    def _place_labels(self, queryset, ids):
+        no_label = force_str(_("No label"))
+        return {pk: label or no_label for pk, label in queryset.values_list("id", "label")}
+
+    def _work_labels(self, queryset, ids):
+        return dict(queryset.values_list("id", "name"))
+
+    def _person_labels(self, queryset, ids):
+        labels = {}
+        rows = queryset.values_list(
+            "id", "preferred_name", "person_title", "kunya", "ism", "nasab", "nisba"
+        )
+        for pk, preferred_name, *parts in rows:
+            labels[pk] = preferred_name or " ".join([part for part in parts if part])
+        return labels
+
+    def _monument_labels(self, queryset, ids):
+        place_labels = self._first_related_labels(
+            MonumentLocatedInPlace, "subj_object_id", "obj_object_id", Place, ids
+        )
+        return {
+            pk: f"{name} ({place_labels.get(pk)})"
+            for pk, name in queryset.values_list("id", "name")
+        }
+
+    def _object_labels(self, queryset, ids):
+        monument_labels = self._first_related_labels(
+            ObjectPartOfMonument, "subj_object_id", "obj_object_id", Monument, ids
+        )
+        no_label = force_str(_("No label"))
+        labels = {}
+        rows = queryset.values_list("id", "object_type_id", "object_type__label")
+        for pk, object_type_id, object_type_label in rows:
+            prefix = f"{object_type_label or no_label} | " if object_type_id else ""
+            if pk in monument_labels:
+                labels[pk] = f"{prefix}{monument_labels[pk]}".strip()
+            else:
+                labels[pk] = f"{prefix}{self._default_label(Object, pk)}"
+        return labels
+
+    def _inscription_labels(self, queryset, ids):
+        object_labels = self._first_related_labels(
+            InscriptionFoundInObject, "subj_object_id", "obj_object_id", Object, ids
+        )
+        return {
+            pk: object_labels.get(pk, self._default_label(Inscription, pk))
+            for pk in queryset.values_list("id", flat=True)
+        }
+
+    def _illustration_labels(self, queryset, ids):
+        inscription_labels = self._first_related_labels(
+            InscriptionRepresentedAsIllustration,
+            "obj_object_id",
+            "subj_object_id",
+            Inscription,
+            ids,
+        )
+        monument_labels = self._first_related_labels(
+            MonumentRepresentedAsIllustration,
+            "obj_object_id",
+            "subj_object_id",
+            Monument,
+            ids,
+        )
+        labels = {}
+        for pk in queryset.values_list("id", flat=True):
+            if pk in inscription_labels:
+                labels[pk] = inscription_labels[pk]
+            elif pk in monument_labels:
+                labels[pk] = monument_labels[pk]
+            else:
+                labels[pk] = self._default_label(Illustration, pk)
+        return labels
+
+
 class GraphSearchSnapshot(models.Model):
     DEFAULT_KEY = "global"
-    CACHE_KEY = "graph_nodes_links_snapshot_v2"
+    COLLECTION_KEY_PREFIX = "collection:"
+    CACHE_KEY = "graph_nodes_links_snapshot_v4"
+    # the fields set by `set_graph`
+    GRAPH_FIELDS = ["data", "node_count", "link_count", "collections"]
+    # only one rebuild runs at a time, across all workers sharing the cache
+    REBUILD_LOCK_KEY = "graph_nodes_links_snapshot_rebuild_lock"
+    REBUILD_LOCK_TIMEOUT = 60 * 30
+    REBUILD_POLL_INTERVAL = 1
+
+    # Relations which feed the label of one endpoint from the other one, as
+    # (relation, field of the entity the label is taken from, field of the
+    # entity whose label depends on it).
+    LABEL_DEPENDENCIES = [
+        (MonumentLocatedInPlace, "obj_object_id", "subj_object_id"),
+        (ObjectPartOfMonument, "obj_object_id", "subj_object_id"),
+        (InscriptionFoundInObject, "obj_object_id", "subj_object_id"),
+        (InscriptionRepresentedAsIllustration, "subj_object_id", "obj_object_id"),
+        (MonumentRepresentedAsIllustration, "subj_object_id", "obj_object_id"),
+    ]
 
     key = models.CharField(max_length=64, unique=True, default=DEFAULT_KEY)
-    nodes = models.JSONField(default=list, blank=True)
-    links = models.JSONField(default=list, blank=True)
+    # the graph in the format of `GraphData.to_bytes`
+    data = models.BinaryField(default=bytes, blank=True)
     node_count = models.PositiveIntegerField(default=0, editable=False)
     link_count = models.PositiveIntegerField(default=0, editable=False)
+    # the collections of the nodes with their node count, sorted by label
+    collections = models.JSONField(default=list, blank=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -740,128 +932,564 @@ class GraphSearchSnapshot(models.Model):
     def __str__(self):
         return f"{self.key} ({self.node_count} nodes / {self.link_count} links)"
 
-    @staticmethod
-    def _assign_node_sizes(nodes, links, max_size=6, base_size=4, scale=10):
-        degree = {}
+    @property
+    def graph(self):
+        return GraphData.from_bytes(bytes(self.data))
+
+    def set_graph(self, graph):
+        self.data = graph.to_bytes()
+        self.node_count = graph.node_count
+        self.link_count = graph.link_count
+        self.collections = sorted(
+            (
+                {"id": pk, "label": label, "count": count}
+                for (pk, label), count in zip(
+                    graph.collections, graph.collection_counts().tolist()
+                )
+                if count
+            ),
+            key=lambda collection: collection["label"].lower(),
+        )
 
-        for link in links:
-            source = link.get("source")
-            target = link.get("target")
-            if source:
-                degree[source] = degree.get(source, 0) + 1
-            if target:
-                degree[target] = degree.get(target, 0) + 1
+    @classmethod
+    def collection_key(cls, collection_id):
+        return f"{cls.COLLECTION_KEY_PREFIX}{collection_id}"
 
-        for node in nodes:
-            d = degree.get(node["id"], 0)
-            size = base_size + max_size * (math.atan(d / scale) / (math.pi / 2))
-            node["size"] = round(size, 2)
+    @classmethod
+    def cache_key(cls, key=DEFAULT_KEY):
+        if key == cls.DEFAULT_KEY:
+            return cls.CACHE_KEY
+        return f"{cls.CACHE_KEY}:{key}"
 
-        return nodes
+    @classmethod
+    def version_cache_key(cls, key=DEFAULT_KEY):
+        return f"{cls.cache_key(key)}:version"
 
     @classmethod
-    def build_payload(cls):
-        nodes = []
+    def collections_cache_key(cls):
+        return f"{cls.CACHE_KEY}:collections"
 
-        def iter_iabase_models(base_model):
-            for model in base_model.__subclasses__():
-                if not model._meta.abstract:
-                    yield model
-                yield from iter_iabase_models(model)
+    @classmethod
+    def clear_cache(cls, keys=None):
+        if keys is None:
+            keys = cls.objects.values_list("key", flat=True)
+        cache_keys = [cls.collections_cache_key()]
+        for key in {cls.DEFAULT_KEY, *keys}:
+            cache_keys.extend([cls.cache_key(key), cls.version_cache_key(key)])
+        cache.delete_many(cache_keys)
 
-        def get_relation_labels(relation):
-            if hasattr(relation, "name") and callable(relation.name):
-                label = relation.name()
-            else:
-                label = relation.__class__.__name__
+    @classmethod
+    def is_built(cls, key=DEFAULT_KEY):
+        """
+        Return whether the snapshot `key` exists, without loading it.
+        """
+        if cache.get(cls.version_cache_key(key)) is not None:
+            return True
+        return cls.objects.filter(key=key).exists()
 
-            if hasattr(relation, "reverse_name") and callable(relation.reverse_name):
-                reverse_label = relation.reverse_name()
-            else:
-                reverse_label = f"{label} [REVERSE]"
+    @classmethod
+    def load(cls, key=DEFAULT_KEY):
+        """
+        Return the version and the `GraphData` of the snapshot stored as
+        `key`, or None if there is none.
+        The latest decoded version of every key is kept in memory, so as
+        long as the version in the shared cache does not change, a worker
+        does not need to fetch and decode the payload again. The returned
+        graph is shared between requests and must not be modified.
+        """
+        version = cache.get(cls.version_cache_key(key))
+        if version is not None:
+            graph = _decoded_snapshots.get_version(key, version)
+            if graph is not None:
+                return version, graph
+            cached_data = cache.get(cls.cache_key(key))
+            if cached_data and cached_data[0] == version:
+                graph = GraphData.from_bytes(cached_data[1])
+                _decoded_snapshots.set_version(key, version, graph)
+                return version, graph
+
+        snapshot = cls.objects.filter(key=key).first()
+        if snapshot is None:
+            return None
+
+        version = snapshot.updated_at.isoformat()
+        payload = bytes(snapshot.data)
+        cache.set_many(
+            {
+                cls.cache_key(key): (version, payload),
+                cls.version_cache_key(key): version,
+            },
+            86400,
+        )
+        graph = GraphData.from_bytes(payload)
+        _decoded_snapshots.set_version(key, version, graph)
+        return version, graph
 
-            return label, reverse_label
+    @classmethod
+    def _decoded_graph(cls, snapshot):
+        """
+        Return the graph of a snapshot row, taken from the decoded snapshots
+        of this process if it was not changed since.
+        """
+        version = snapshot.updated_at.isoformat()
+        graph = _decoded_snapshots.get_version(snapshot.key, version)
+        if graph is not None:
+            return graph
+        return snapshot.graph
 
-        def get_collections_by_object_id(model, object_ids):
-            if not object_ids:
-                return {}
+    @classmethod
+    def collection_choices(cls):
+        """
+        Return the collections of the graph with their node count, sorted
+        by their label, as stored with the global snapshot.
+        """
+        choices = cache.get(cls.collections_cache_key())
+        if choices is None:
+            choices = (
+                cls.objects.filter(key=cls.DEFAULT_KEY)
+                .values_list("collections", flat=True)
+                .first()
+            ) or []
+            cache.set(cls.collections_cache_key(), choices)
+        return choices
 
-            content_type = ContentType.objects.get_for_model(model)
-            collection_map = {}
-            collection_links = (
-                SkosCollectionContentObject.objects.filter(
-                    content_type=content_type,
-                    object_id__in=object_ids,
-                )
-                .select_related("collection")
-                .iterator(chunk_size=5000)
-            )
-            for link in collection_links:
-                collection_map.setdefault(link.object_id, []).append(
-                    {
-                        "id": link.collection_id,
-                        "label": str(link.collection),
-                    }
-                )
-            return collection_map
+    @staticmethod
+    def _assign_node_sizes(nodes, links):
+        """
+        Set the size of the nodes from their degree in `links`.
+        """
+        degrees = count_degrees(
+            [node["id"] for node in nodes],
+            [link.get("source") or 0 for link in links],
+            [link.get("target") or 0 for link in links],
+        )
+        for node, size in zip(nodes, node_sizes(degrees).tolist()):
+            node["size"] = size
 
-        def add_nodes(qs, group, collection_map):
-            for obj in qs:
-                node = {"id": obj.id, "label": str(obj), "group": group}
-                collections = collection_map.get(obj.id, [])
-                if collections:
-                    node["collection_ids"] = [collection["id"] for collection in collections]
-                    node["collections"] = collections
-                nodes.append(node)
+        return nodes
+
+    @staticmethod
+    def _iter_concrete_subclasses(base_model):
+        def iter_subclasses(base_model):
+            for model in base_model.__subclasses__():
+                if not model._meta.abstract:
+                    yield model
+                yield from iter_subclasses(model)
 
         seen_models = set()
-        for model in iter_iabase_models(IABaseModel):
+        for model in iter_subclasses(base_model):
             if model in seen_models:
                 continue
             seen_models.add(model)
-            queryset = model.objects.only("id")
-            object_ids = list(queryset.values_list("id", flat=True))
-            collection_map = get_collections_by_object_id(model, object_ids)
-            add_nodes(queryset, model._meta.model_name, collection_map)
+            yield model
 
-        node_ids = {n["id"] for n in nodes}
-        links = []
-        relations = (
-            Relation.objects.select_subclasses()
-            .exclude(subj_object_id__isnull=True, obj_object_id__isnull=True)
-            .filter(subj_object_id__in=node_ids, obj_object_id__in=node_ids)
-            .iterator(chunk_size=5000)
+    @classmethod
+    def _iter_entity_models(cls):
+        return cls._iter_concrete_subclasses(IABaseModel)
+
+    @classmethod
+    def _iter_relation_models(cls):
+        return cls._iter_concrete_subclasses(Relation)
+
+    @staticmethod
+    def _get_relation_labels(relation):
+        """
+        Return the label and reverse label of a relation model or instance.
+        """
+        model = relation if isinstance(relation, type) else type(relation)
+        if hasattr(model, "name") and callable(model.name):
+            label = force_str(model.name())
+        else:
+            label = model.__name__
+
+        if hasattr(model, "reverse_name") and callable(model.reverse_name):
+            reverse_label = force_str(model.reverse_name())
+        else:
+            reverse_label = f"{label} [REVERSE]"
+
+        return label, reverse_label
+
+    @classmethod
+    def _get_collections_by_object_id(cls, object_ids=None):
+        """
+        Map the ids of the entities in `object_ids`, or of all entities, to
+        the collections they are part of. Entity ids are unique across the
+        entity models, so one pass over the memberships of all of them is
+        enough, and every collection label is computed once.
+        """
+        if object_ids is not None and not object_ids:
+            return {}
+
+        memberships = SkosCollectionContentObject.objects.filter(
+            content_type__in=cls._entity_content_types()
         )
-        for relation in relations:
-            label, reverse_label = get_relation_labels(relation)
-            links.append(
-                {
-                    "source": relation.subj_object_id,
-                    "target": relation.obj_object_id,
-                    "label": label,
-                    "reverse_label": reverse_label,
-                    "group": f"{label}|{reverse_label}",
-                }
+        if object_ids is not None:
+            memberships = memberships.filter(object_id__in=object_ids)
+        collection_labels = {
+            collection.pk: str(collection)
+            for collection in SkosCollection.objects.filter(
+                pk__in=memberships.values("collection_id")
             )
+        }
 
+        collection_map = {}
+        rows = memberships.values_list("object_id", "collection_id").iterator(
+            chunk_size=5000
+        )
+        for object_id, collection_id in rows:
+            collection_map.setdefault(object_id, []).append(
+                {"id": collection_id, "label": collection_labels[collection_id]}
+            )
+        return collection_map
+
+    @staticmethod
+    def _add_collections(nodes, collection_map):
+        for node in nodes:
+            collections = collection_map.get(node["id"], [])
+            if collections:
+                node["collection_ids"] = [collection["id"] for collection in collections]
+                node["collections"] = collections
+        return nodes
+
+    @staticmethod
+    def _build_link(relation_id, source, target, label, reverse_label):
+        return {
+            "id": relation_id,
+            "source": source,
+            "target": target,
+            "label": label,
+            "reverse_label": reverse_label,
+            "group": f"{label}|{reverse_label}",
+        }
+
+    @classmethod
+    def _build_nodes(cls, model, label_resolver, object_ids=None):
+        """
+        Build the nodes of `model`, without their collections.
+        """
+        labels = label_resolver.labels(model, object_ids)
+        group = model._meta.model_name
+        return [
+            {"id": object_id, "label": label, "group": group}
+            for object_id, label in labels.items()
+        ]
+
+    @classmethod
+    def _entity_content_types(cls):
+        return list(
+            ContentType.objects.get_for_models(*cls._iter_entity_models()).values()
+        )
+
+    @classmethod
+    def _build_links(cls, model):
+        # the labels are class level, so the relation rows are only needed
+        # for their endpoints
+        label, reverse_label = cls._get_relation_labels(model)
+        # endpoints without a node are dropped by `build_payload`
+        entity_content_types = cls._entity_content_types()
+        rows = (
+            model.objects.filter(
+                subj_object_id__isnull=False,
+                obj_object_id__isnull=False,
+                subj_content_type__in=entity_content_types,
+                obj_content_type__in=entity_content_types,
+            )
+            .values_list("pk", "subj_object_id", "obj_object_id")
+            .iterator(chunk_size=5000)
+        )
+        return [
+            cls._build_link(relation_id, source, target, label, reverse_label)
+            for relation_id, source, target in rows
+        ]
+
+    @classmethod
+    def _build_part(cls, kind, model, label_resolver=None):
+        """
+        Build the nodes of an entity model or the links of a relation model.
+        """
+        if kind == "nodes":
+            return cls._build_nodes(model, label_resolver or GraphLabelResolver())
+        return cls._build_links(model)
+
+    @classmethod
+    def build_payload(cls, workers=1):
+        """
+        Build the nodes and links of the whole graph. With more than one
+        worker, the nodes of every entity model and the links of every
+        relation model are built in a pool of worker processes, each with
+        its own database connections.
+        """
+        parts = [("nodes", model) for model in cls._iter_entity_models()]
+        parts += [("links", model) for model in cls._iter_relation_models()]
+        if workers > 1:
+            # the worker processes must not share the connections of this one
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_build_worker
+            ) as executor:
+                results = list(
+                    executor.map(
+                        _build_snapshot_part,
+                        [kind for kind, model in parts],
+                        [model._meta.label for kind, model in parts],
+                    )
+                )
+        else:
+            label_resolver = GraphLabelResolver()
+            results = [
+                cls._build_part(kind, model, label_resolver) for kind, model in parts
+            ]
+
+        nodes, links = [], []
+        for (kind, model), result in zip(parts, results):
+            (nodes if kind == "nodes" else links).extend(result)
+
+        # relations of entities that are not shown, e.g. of unlisted models
+        node_ids = {node["id"] for node in nodes}
+        links = [
+            link
+            for link in links
+            if link["source"] in node_ids and link["target"] in node_ids
+        ]
+        cls._add_collections(nodes, cls._get_collections_by_object_id())
         nodes = cls._assign_node_sizes(nodes, links)
         return nodes, links
 
     @classmethod
-    def rebuild(cls):
-        nodes, links = cls.build_payload()
-        snapshot, _ = cls.objects.update_or_create(
-            key=cls.DEFAULT_KEY,
-            defaults={
-                "nodes": nodes,
-                "links": links,
-                "node_count": len(nodes),
-                "link_count": len(links),
-            },
+    def _save_collection_shards(cls, graph, collection_ids=None):
+        """
+        Store the shards of `collection_ids` (or of all collections) and
+        drop the ones of collections that do not contain any node anymore.
+        Returns the keys of all shards that were written or deleted.
+        """
+        shards = graph.collection_shards(collection_ids)
+        stale = cls.objects.filter(key__startswith=cls.COLLECTION_KEY_PREFIX)
+        if collection_ids is not None:
+            stale = stale.filter(
+                key__in=[cls.collection_key(pk) for pk in collection_ids]
+            )
+        stale = stale.exclude(key__in=[cls.collection_key(pk) for pk in shards])
+        stale_keys = list(stale.values_list("key", flat=True))
+        stale.delete()
+
+        rows = []
+        for collection_id, shard in shards.items():
+            row = cls(key=cls.collection_key(collection_id))
+            row.set_graph(shard)
+            rows.append(row)
+        cls.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["key"],
+            update_fields=[*cls.GRAPH_FIELDS, "updated_at"],
         )
-        cache.delete(cls.CACHE_KEY)
+        return stale_keys + [cls.collection_key(pk) for pk in shards]
+
+    @classmethod
+    def rebuild(cls, workers=1):
+        nodes, links = cls.build_payload(workers=workers)
+        graph = GraphData.from_dicts(nodes, links)
+        old_keys = list(cls.objects.values_list("key", flat=True))
+        with transaction.atomic():
+            row = cls(key=cls.DEFAULT_KEY)
+            row.set_graph(graph)
+            snapshot, _ = cls.objects.update_or_create(
+                key=cls.DEFAULT_KEY,
+                defaults={field: getattr(row, field) for field in cls.GRAPH_FIELDS},
+            )
+            cls._save_collection_shards(graph)
+        cls.clear_cache(old_keys)
         return snapshot
 
+    @classmethod
+    def _acquire_rebuild_lock(cls, wait=False, force=False):
+        """
+        Return a token for the rebuild lock, or None if another rebuild
+        holds it. With `wait`, block until the other rebuild is done, with
+        `force`, take the lock even if it is held.
+        """
+        token = uuid.uuid4().hex
+        if force:
+            cache.set(cls.REBUILD_LOCK_KEY, token, cls.REBUILD_LOCK_TIMEOUT)
+            return token
+        while not cache.add(cls.REBUILD_LOCK_KEY, token, cls.REBUILD_LOCK_TIMEOUT):
+            if not wait:
+                return None
+            time.sleep(cls.REBUILD_POLL_INTERVAL)
+        return token
+
+    @classmethod
+    def _release_rebuild_lock(cls, token):
+        if cache.get(cls.REBUILD_LOCK_KEY) == token:
+            cache.delete(cls.REBUILD_LOCK_KEY)
+
+    @classmethod
+    def is_rebuilding(cls):
+        return cache.get(cls.REBUILD_LOCK_KEY) is not None
+
+    @classmethod
+    def _rebuild_with_lock(cls, token, workers=1):
+        try:
+            return cls.rebuild(workers=workers)
+        finally:
+            cls._release_rebuild_lock(token)
+
+    @classmethod
+    def _rebuild_in_background(cls, token, workers=1):
+        try:
+            cls._rebuild_with_lock(token, workers)
+        except Exception:
+            logger.exception("Rebuilding the graph snapshot failed")
+        finally:
+            connections.close_all()
+
+    @classmethod
+    def schedule_rebuild(cls, background=True, wait=False, force=False, workers=1):
+        """
+        Rebuild the snapshots unless another rebuild is already running.
+        The existing snapshots are served until the rebuild replaces them.
+        With `background`, the rebuild runs in a worker thread and this
+        returns at once, otherwise it runs in the calling thread and its
+        errors are raised. See `_acquire_rebuild_lock` for `wait` and
+        `force` and `build_payload` for `workers`. Return whether a rebuild
+        was started.
+        """
+        token = cls._acquire_rebuild_lock(wait=wait, force=force)
+        if token is None:
+            logger.debug("Graph snapshot rebuild already running")
+            return False
+        if not background:
+            cls._rebuild_with_lock(token, workers)
+            return True
+        thread = threading.Thread(
+            target=cls._rebuild_in_background,
+            args=(token, workers),
+            name="graph-snapshot-rebuild",
+            daemon=True,
+        )
+        thread.start()
+        return True
+
+    @classmethod
+    def _label_dependents(cls, object_ids):
+        """
+        Return the ids of all entities whose label is derived (directly or
+        transitively) from one of the entities in `object_ids`.
+        """
+        dependents = set()
+        pending = set(object_ids)
+        while pending:
+            found = set()
+            for relation, source_field, dependent_field in cls.LABEL_DEPENDENCIES:
+                found.update(
+                    relation.objects.filter(
+                        **{f"{source_field}__in": pending}
+                    ).values_list(dependent_field, flat=True)
+                )
+            found.discard(None)
+            pending = found - dependents - set(object_ids)
+            dependents |= pending
+        return dependents
+
+    @classmethod
+    def _entity_nodes(cls, object_ids):
+        nodes = []
+        label_resolver = GraphLabelResolver()
+        for model in cls._iter_entity_models():
+            nodes.extend(cls._build_nodes(model, label_resolver, object_ids))
+        return cls._add_collections(
+            nodes, cls._get_collections_by_object_id([node["id"] for node in nodes])
+        )
+
+    @classmethod
+    def _relation_links(cls, relation_ids):
+        relations = (
+            Relation.objects.select_subclasses()
+            .filter(pk__in=relation_ids)
+            .exclude(subj_object_id__isnull=True)
+            .exclude(obj_object_id__isnull=True)
+        )
+        return [
+            cls._build_link(
+                relation.id,
+                relation.subj_object_id,
+                relation.obj_object_id,
+                *cls._get_relation_labels(relation),
+            )
+            for relation in relations
+        ]
+
+    @classmethod
+    def apply_changes(
+        cls,
+        entity_ids=(),
+        relation_ids=(),
+        deleted_entity_ids=(),
+        deleted_relation_ids=(),
+    ):
+        """
+        Patch the stored snapshot for saved or deleted entities and relations
+        instead of rebuilding it from scratch. If there is no snapshot yet,
+        nothing is done - it will be built on its first use.
+        Deleted ids are refreshed like the others: whatever still exists in
+        the database is kept, everything else is dropped. Only the changed
+        nodes and links are built, they are patched into the arrays of the
+        stored graph.
+        """
+        entity_ids = (set(entity_ids) | set(deleted_entity_ids)) - {None}
+        relation_ids = (set(relation_ids) | set(deleted_relation_ids)) - {None}
+        refresh_ids = entity_ids | cls._label_dependents(entity_ids)
+
+        with transaction.atomic():
+            snapshot = (
+                cls.objects.select_for_update()
+                .filter(key=cls.DEFAULT_KEY)
+                .defer("data")
+                .first()
+            )
+            if snapshot is None:
+                return None
+
+            old_graph = cls._decoded_graph(snapshot)
+            changed = GraphData.from_dicts(
+                cls._entity_nodes(refresh_ids), cls._relation_links(relation_ids)
+            )
+            graph = old_graph.replace(
+                changed, removed_node_ids=refresh_ids, removed_link_ids=relation_ids
+            )
+            graph.node_size = node_sizes(graph.degrees()).astype(np.float32)
+            snapshot.set_graph(graph)
+            snapshot.save()
+
+            # shards hold the nodes of their collection and the links
+            # touching them, so the collections of the endpoints of changed
+            # links are affected as well
+            affected_ids = set(refresh_ids)
+            relation_ids = np.asarray(list(relation_ids), dtype=np.int64)
+            for before, after in ((old_graph, graph), (graph, old_graph)):
+                changed_links = np.isin(before.link_id, relation_ids)
+                changed_links |= ~np.isin(before.link_id, after.link_id)
+                affected_ids.update(before.link_source[changed_links].tolist())
+                affected_ids.update(before.link_target[changed_links].tolist())
+            affected_collection_ids = old_graph.collection_ids_of(affected_ids)
+            affected_collection_ids |= graph.collection_ids_of(affected_ids)
+            shard_keys = cls._save_collection_shards(graph, affected_collection_ids)
+        cls.clear_cache(shard_keys)
+        return snapshot
+
+
+def _init_build_worker():
+    # processes which are spawned instead of forked start without Django
+    django.setup()
+
+
+def _build_snapshot_part(kind, model_label):
+    """
+    Build a part of the graph snapshot in a worker process, see
+    `GraphSearchSnapshot.build_payload`.
+    """
+    return GraphSearchSnapshot._build_part(kind, apps.get_model(model_label))
+
 
 auditlog.register(MonumentType)
 auditlog.register(Material)
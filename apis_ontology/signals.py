@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from functools import partial
+
+from apis_core.collections.models import SkosCollection, SkosCollectionContentObject
+from apis_core.generic.signals import post_merge_with
+from apis_core.relations.models import Relation
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from apis_ontology.models import GraphSearchSnapshot, IABaseModel, IARelationMixin
+
+logger = logging.getLogger(__name__)
+
+# changes of committed transactions, waiting to be applied by the worker
+_queued_changes = None
+_queue_lock = threading.Lock()
+_worker = None
+
+
+def _apply_queued_changes():
+    """
+    Apply the queued changes in the background, merging everything that
+    was committed while the previous batch was applied into one update.
+    """
+    global _queued_changes, _worker
+    try:
+        while True:
+            # a running rebuild may have read the database before these
+            # changes were committed and would save its payload over the
+            # patch, so they are applied once it is done
+            while GraphSearchSnapshot.is_rebuilding():
+                time.sleep(GraphSearchSnapshot.REBUILD_POLL_INTERVAL)
+            with _queue_lock:
+                changes, _queued_changes = _queued_changes, None
+                if changes is None:
+                    _worker = None
+                    return
+            try:
+                GraphSearchSnapshot.apply_changes(**changes)
+            except Exception:
+                # a stale graph is better than a failing save, the rebuild
+                # picks the changes up
+                logger.exception("Could not update graph snapshot")
+                GraphSearchSnapshot.schedule_rebuild()
+    finally:
+        connections.close_all()
+
+
+def _queue_graph_changes(changes):
+    global _queued_changes, _worker
+    with _queue_lock:
+        if _queued_changes is None:
+            _queued_changes = {
+                "entity_ids": set(),
+                "relation_ids": set(),
+                "deleted_entity_ids": set(),
+                "deleted_relation_ids": set(),
+            }
+        for key, ids in changes.items():
+            _queued_changes[key].update(ids)
+        if _worker is None:
+            # not a daemon, so that short lived processes like management
+            # commands apply their changes before they exit
+            _worker = threading.Thread(
+                target=_apply_queued_changes, name="graph-snapshot-changes"
+            )
+            _worker.start()
+
+
+def _incremental_updates_enabled():
+    return getattr(settings, "GRAPH_SNAPSHOT_INCREMENTAL", True)
+
+
+def _schedule_graph_change(**changes):
+    """
+    Queue the changes for the graph snapshot once the current transaction
+    is committed. Django drops the callbacks of rolled back transactions
+    and savepoints, so only committed changes reach the snapshot.
+    """
+    if not _incremental_updates_enabled():
+        return
+    changes = {key: set(ids) for key, ids in changes.items()}
+    transaction.on_commit(partial(_queue_graph_changes, changes))
+
+
+def _collection_entity_id(instance):
+    model = instance.content_type.model_class()
+    if model is not None and issubclass(model, IABaseModel):
+        return instance.object_id
+    return None
+
+
+@receiver(post_save)
+def update_graph_snapshot_on_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    if isinstance(instance, IABaseModel):
+        _schedule_graph_change(entity_ids=[instance.pk])
+    elif isinstance(instance, IARelationMixin):
+        _schedule_graph_change(
+            relation_ids=[instance.pk],
+            entity_ids=[instance.subj_object_id, instance.obj_object_id],
+        )
+    elif isinstance(instance, SkosCollectionContentObject):
+        if entity_id := _collection_entity_id(instance):
+            _schedule_graph_change(entity_ids=[entity_id])
+    elif isinstance(instance, SkosCollection) and not kwargs.get("created"):
+        # the label of the collection is stored with its members
+        members = SkosCollectionContentObject.objects.filter(
+            collection=instance,
+            content_type__in=GraphSearchSnapshot._entity_content_types(),
+        )
+        _schedule_graph_change(
+            entity_ids=members.values_list("object_id", flat=True)
+        )
+
+
+@receiver(pre_delete)
+def collect_graph_label_dependents(sender, instance, **kwargs):
+    """
+    Labels that are derived from an entity have to be refreshed when it is
+    deleted, but the relations leading to them are detached on deletion.
+    """
+    if isinstance(instance, IABaseModel) and _incremental_updates_enabled():
+        _schedule_graph_change(
+            entity_ids=GraphSearchSnapshot._label_dependents([instance.pk])
+        )
+
+
+@receiver(post_delete)
+def update_graph_snapshot_on_delete(sender, instance, **kwargs):
+    if isinstance(instance, IABaseModel):
+        _schedule_graph_change(deleted_entity_ids=[instance.pk])
+    elif isinstance(instance, IARelationMixin):
+        _schedule_graph_change(
+            deleted_relation_ids=[instance.pk],
+            entity_ids=[instance.subj_object_id, instance.obj_object_id],
+        )
+    elif isinstance(instance, SkosCollectionContentObject):
+        if entity_id := _collection_entity_id(instance):
+            _schedule_graph_change(entity_ids=[entity_id])
+
+
+@receiver(post_merge_with)
+def update_graph_snapshot_on_merge(sender, instance, entities, **kwargs):
+    """
+    Merging re-points the relations of the merged entities to `instance`
+    with `QuerySet.update()`, which sends no signals, before deleting them.
+    """
+    if not isinstance(instance, IABaseModel) or not _incremental_updates_enabled():
+        return
+    # depending on the order of the receivers, the relations are already
+    # re-pointed or not, the ones of both sides are refreshed
+    object_ids = [instance.pk, *(entity.pk for entity in entities)]
+    relations = Relation.objects.filter(
+        Q(subj_object_id__in=object_ids) | Q(obj_object_id__in=object_ids)
+    )
+    _schedule_graph_change(
+        entity_ids=[instance.pk],
+        relation_ids=relations.values_list("pk", flat=True),
+    )
@@ -2,13 +2,18 @@ from django.urls import include, path
 
 from apis_acdhch_default_settings.urls import urlpatterns
 
-from apis_ontology.views import GraphView
+from apis_ontology.views import GraphDataView, GraphView
 
 urlpatterns += [    path(
         "graph/",
         GraphView.as_view(),
         name="graph_view",
     ),
+    path(
+        "graph/data/",
+        GraphDataView.as_view(),
+        name="graph_data_view",
+    ),
 ]
 urlpatterns += [
     path("highlighter/", include("apis_highlighter.urls", namespace="highlighter")),
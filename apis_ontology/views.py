@@ -1,13 +1,58 @@
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_cosmograph.views import CosmographView
 from .models import GraphSearchSnapshot
-from django.core.cache import cache
+import hashlib
 import json
 import math
 import logging
+
+import numpy as np
+from django.conf import settings
 from django_cosmograph.utils import assign_node_sizes
 
+from .graph_utils import GraphData, GraphSearchIndex, LRUCache, node_sizes
+
 logger = logging.getLogger(__name__)
 
+# search indexes and merged shards are built once per snapshot version
+# and worker process, keyed by the snapshot keys they are built from
+_search_indexes = LRUCache(maxsize=16)
+_merged_shards = LRUCache(maxsize=16)
+# node and link positions shown for popular parameters, every entry can
+# hold arrays as large as the graph
+_filtered_graphs = LRUCache(maxsize=16)
+
+# number of nodes or links serialized per chunk of the streamed response
+STREAM_CHUNK_SIZE = 5000
+# neighbourhoods are limited to this many links around the focused node
+FOCUS_DEFAULT_DEPTH = 1
+FOCUS_MAX_DEPTH = 5
+# graphs with more nodes are collapsed into super-nodes unless `lod=off`
+DEFAULT_LOD_THRESHOLD = 5000
+LOD_LEVELS = ("group", "collection")
+
+def _store_derived(derived, key, version, value):
+    """
+    Store `value` derived from the snapshots of `version` in `derived`, and
+    drop everything derived from other versions of these snapshots. The
+    entries for exactly these snapshots are only replaced, the search
+    index of the previous version is the base of the next one.
+    """
+    current = dict(version)
+
+    def superseded(key, entry):
+        if key == tuple(current):
+            return False
+        return any(current.get(name, stored) != stored for name, stored in entry[0])
+
+    for cache in (_search_indexes, _merged_shards, _filtered_graphs):
+        cache.discard_where(superseded)
+    derived.set_version(key, version, value)
+
+
 class GraphView(CosmographView):
     # TODO: How do I restrict the view based on user permissions
 
@@ -24,159 +69,343 @@ class GraphView(CosmographView):
                 selected_ids.add(int(value))
         return selected_ids
 
-    def _apply_collection_filter(self, nodes, links):
-        selected_collection_ids = self._get_selected_collection_ids()
-        if not selected_collection_ids:
-            return nodes, links
-
-        filtered_nodes = [
-            node
-            for node in nodes
-            if selected_collection_ids.intersection(node.get("collection_ids", []))
-        ]
-        filtered_node_ids = {node.get("id") for node in filtered_nodes}
-
-        filtered_links = [
-            link
-            for link in links
-            if link.get("source") in filtered_node_ids
-            and link.get("target") in filtered_node_ids
-        ]
+    def _get_snapshot_graph(self, collection_ids=None):
+        """
+        Return the graph of the snapshot, merged from the shards of the
+        selected collections if any. While there is no snapshot yet, a
+        rebuild is started in the background and an empty graph is
+        returned, with `self._graph_building` set.
+        The graph is loaded at most once per request, later calls return
+        the same graph.
+        """
+        key = frozenset(collection_ids or ())
+        loaded = getattr(self, "_snapshot_graphs", None)
+        if loaded is None:
+            loaded = self._snapshot_graphs = {}
+        if key not in loaded:
+            graph = self._load_snapshot_graph(collection_ids)
+            loaded[key] = (graph, self._snapshot_version, self._graph_building)
+        graph, self._snapshot_version, self._graph_building = loaded[key]
+        return graph
 
-        return filtered_nodes, filtered_links
+    def _load_snapshot_graph(self, collection_ids=None):
+        self._graph_building = False
+        self._snapshot_version = None
+        # the global payload is only needed for unfiltered requests
+        if collection_ids:
+            global_snapshot = GraphSearchSnapshot.is_built()
+        else:
+            global_snapshot = GraphSearchSnapshot.load(GraphSearchSnapshot.DEFAULT_KEY)
+        if not global_snapshot:
+            logger.debug("Graph snapshot missing - rebuilding in the background")
+            GraphSearchSnapshot.schedule_rebuild()
+            self._graph_building = True
+            return GraphData()
 
-    def _collection_choices(self, nodes):
-        choices = {}
-        for node in nodes:
-            for collection in node.get("collections", []):
-                collection_id = collection.get("id")
-                if collection_id is None:
-                    continue
-                choices[collection_id] = collection.get("label", str(collection_id))
+        if not collection_ids:
+            version, graph = global_snapshot
+            self._snapshot_version = ((GraphSearchSnapshot.DEFAULT_KEY, version),)
+            return graph
 
-        return [
-            {"id": collection_id, "label": label}
-            for collection_id, label in sorted(
-                choices.items(), key=lambda item: item[1].lower()
-            )
-        ]
+        shards = []
+        versions = []
+        for collection_id in sorted(collection_ids):
+            key = GraphSearchSnapshot.collection_key(collection_id)
+            shard = GraphSearchSnapshot.load(key)
+            if shard is not None:
+                versions.append((key, shard[0]))
+                shards.append(shard[1])
+        version = self._snapshot_version = tuple(versions)
+        keys = tuple(key for key, _ in version)
+        merged = _merged_shards.get_version(keys, version)
+        if merged is None:
+            # shards contain links to nodes of other collections
+            merged = GraphData.merge(shards)
+            _store_derived(_merged_shards, keys, version, merged)
+        return merged
 
-    def _serialize_nodes_for_cosmograph(self, nodes):
-        serialized_nodes = []
-        for node in nodes:
-            clean_node = dict(node)
-            clean_node.pop("collection_ids", None)
-            clean_node.pop("collections", None)
-            serialized_nodes.append(clean_node)
-        return serialized_nodes
-
-    def _get_snapshot_nodes_links(self):
-        cache_key = GraphSearchSnapshot.CACHE_KEY
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return json.loads(cached_data)
-
-        snapshot = GraphSearchSnapshot.objects.filter(
-            key=GraphSearchSnapshot.DEFAULT_KEY
-        ).first()
-        if snapshot is None:
-            logger.debug("Graph snapshot missing - rebuilding from source models")
-            snapshot = GraphSearchSnapshot.rebuild()
-
-        nodes = snapshot.nodes
-        links = snapshot.links
-        cache.set(cache_key, json.dumps((nodes, links)), 86400)
-        return nodes, links
+    def _get_search_index(self, graph):
+        version = getattr(self, "_snapshot_version", None)
+        if not version:
+            return GraphSearchIndex(graph)
+        keys = tuple(key for key, _ in version)
+        index = _search_indexes.get_version(keys, version)
+        if index is None:
+            previous = _search_indexes.get(keys)
+            index = GraphSearchIndex(graph, previous and previous[1])
+            _store_derived(_search_indexes, keys, version, index)
+        return index
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        snapshot_nodes, _ = self._get_snapshot_nodes_links()
         context["graph_query"] = self.request.GET.get("q", "").strip()
-        context["graph_collection_choices"] = self._collection_choices(snapshot_nodes)
+        context["graph_focus"] = self._get_focus()
+        context["graph_focus_depths"] = range(1, FOCUS_MAX_DEPTH + 1)
+        context["graph_group"] = self.request.GET.get("group", "").strip()
+        context["graph_lod"] = self.request.GET.get("lod", "").strip()
+        context["graph_collection_choices"] = GraphSearchSnapshot.collection_choices()
         context["graph_selected_collection_ids"] = self._get_selected_collection_ids()
+        context["graph_data_url"] = reverse("graph_data_view")
+        if self.request.GET:
+            context["graph_data_url"] += f"?{self.request.GET.urlencode()}"
         return context
 
     def get_params(self, *args, **kwargs):
-        params = super().get_params(*args, **kwargs)
+        params = dict(super().get_params(*args, **kwargs))
         params["renderLinks"] = getattr(self, "_graph_has_links", True)
         return params
 
-    def _filter_nodes_links(self, nodes, links):
+    def _get_focus(self):
+        """
+        Return the id of the node given as `focus` and the `depth` of its
+        neighbourhood to show, or None.
+        """
+        # `isdigit` is also true for digits `int` does not accept, like "²"
+        focus = self.request.GET.get("focus", "").strip()
+        if not (focus.isascii() and focus.isdigit()):
+            return None
+        if int(focus) > np.iinfo(np.int64).max:
+            # node ids are stored as int64
+            return None
+        depth = self.request.GET.get("depth", "").strip()
+        if depth.isascii() and depth.isdigit():
+            depth = int(depth)
+        else:
+            depth = FOCUS_DEFAULT_DEPTH
+        return int(focus), min(max(depth, 1), FOCUS_MAX_DEPTH)
+
+    def _filter_positions(self, graph):
+        """
+        Return the positions of the nodes and links in the neighbourhood
+        of the focused node or else matching the query, or None to show
+        the whole graph.
+        """
+        focus = self._get_focus()
+        if focus is not None:
+            node_id, depth = focus
+            positions, found = graph.positions_of([node_id])
+            return graph.neighbourhood(positions[found], depth)
+
         query = self.request.GET.get("q", "").strip().lower()
         if not query:
-            return nodes, links
-
-        def matches_query(value):
-            if isinstance(value, dict):
-                return any(matches_query(v) for v in value.values())
-            if isinstance(value, (list, tuple, set)):
-                return any(matches_query(v) for v in value)
-            return query in str(value).lower()
-
-        matching_nodes = [
-            node
-            for node in nodes
-            if matches_query(node)
-        ]
+            return None, None
 
-        matching_node_ids = {node.get("id") for node in matching_nodes}
+        return self._get_search_index(graph).filter(query)
 
-        matching_links = [link for link in links if matches_query(link)]
+    def _get_graph_params(self):
+        """
+        Return the normalized request parameters the shown graph depends on.
+        """
+        return {
+            "q": self.request.GET.get("q", "").strip().lower(),
+            "collection": sorted(self._get_selected_collection_ids()),
+            "focus": self._get_focus(),
+            "group": self.request.GET.get("group", "").strip(),
+            "lod": self.request.GET.get("lod", "").strip(),
+        }
 
-        links_of_matching_nodes = [
-            link
-            for link in links
-            if link.get("source") in matching_node_ids
-            or link.get("target") in matching_node_ids
-        ]
+    def get_graph(self):
+        """
+        Return the snapshot graph, the positions of the nodes and links
+        to show after applying the collection, focus and query filters
+        and the node sizes for the filtered graph, or None to keep the
+        stored ones. The filtered positions are cached for the current
+        version of the snapshots.
+        """
+        collection_ids = self._get_selected_collection_ids()
+        graph = self._get_snapshot_graph(collection_ids)
+        logger.debug(
+            f"Generated graph with {graph.node_count} nodes and {graph.link_count} links"
+        )
+        if not self._snapshot_version:
+            return (graph, *self._filter_graph(graph, collection_ids))
 
-        if not matching_node_ids and not matching_links:
-            return [], []
+        params = self._get_graph_params()
+        del params["lod"]
+        version = self._snapshot_version
+        key = (tuple(name for name, _ in version), json.dumps(params))
+        result = _filtered_graphs.get_version(key, version)
+        if result is None:
+            result = self._filter_graph(graph, collection_ids)
+            if result[2] is None:
+                # nothing was filtered, all positions are shown
+                return (graph, *result)
+            for array in result:
+                # shared between requests
+                array.flags.writeable = False
+            _store_derived(_filtered_graphs, key, version, result)
+        return (graph, *result)
 
-        # Include all links that match directly and all links connected to matching nodes.
-        filtered_links = []
-        seen_links = set()
-        for link in matching_links + links_of_matching_nodes:
-            key = json.dumps(link, sort_keys=True, default=str)
-            if key in seen_links:
-                continue
-            seen_links.add(key)
-            filtered_links.append(link)
+    def _filter_graph(self, graph, collection_ids):
+        node_positions, link_positions = self._filter_positions(graph)
+        filtered = node_positions is not None or bool(collection_ids)
+        if node_positions is None:
+            node_positions = np.arange(graph.node_count)
+            link_positions = np.arange(graph.link_count)
+        group = self.request.GET.get("group", "").strip()
+        if group:
+            # drill down into a group of the level of detail view
+            filtered = True
+            code = graph.groups.index(group) if group in graph.groups else -1
+            node_positions = node_positions[graph.node_group[node_positions] == code]
+            link_positions = graph.induced(node_positions, link_positions)
+        if not filtered:
+            return node_positions, link_positions, None
 
-        visible_node_ids = set()
-        for link in filtered_links:
-            visible_node_ids.add(link.get("source"))
-            visible_node_ids.add(link.get("target"))
-
-        # Keep all matched nodes, even if they have no incident links.
-        filtered_nodes = list(matching_nodes)
-        for node in nodes:
-            if node.get("id") in visible_node_ids and node not in filtered_nodes:
-                filtered_nodes.append(node)
+        logger.debug(
+            f"After filtering, graph has {len(node_positions)} nodes and {len(link_positions)} links"
+        )
+        # size the nodes by their degree in the filtered graph
+        sizes = node_sizes(graph.degrees(link_positions))
+        return node_positions, link_positions, sizes
 
-        return filtered_nodes, filtered_links
+    def _get_level_of_detail(self, graph, node_positions):
+        """
+        Return whether to collapse the nodes by `group` or `collection`,
+        or None to show them all. Above the `GRAPH_LOD_THRESHOLD` setting
+        nodes are collapsed by group, or by collection once a group is
+        selected, unless the `lod` parameter says otherwise. Levels that
+        are already filtered by, or that would collapse all nodes into a
+        single super-node, are skipped, as drilling into them would show
+        the same nodes again.
+        """
+        lod = self.request.GET.get("lod", "").strip()
+        if lod in LOD_LEVELS:
+            return lod
+        threshold = getattr(settings, "GRAPH_LOD_THRESHOLD", DEFAULT_LOD_THRESHOLD)
+        if lod == "off" or not threshold or len(node_positions) <= threshold:
+            return None
+        filtered = {
+            "group": bool(self.request.GET.get("group", "").strip()),
+            "collection": bool(self._get_selected_collection_ids()),
+        }
+        for level in LOD_LEVELS:
+            if filtered[level]:
+                continue
+            if graph.aggregate_count(node_positions, level) > 1:
+                return level
+        return None
 
     def get_nodes_links(self):
-        nodes, links = self._get_snapshot_nodes_links()
-        logger.debug(f"Generated graph with {len(nodes)} nodes and {len(links)} links")
+        # the page only renders the form, nodes and links are fetched
+        # from GraphDataView once the page has loaded
+        return [], []
 
-        nodes, links = self._apply_collection_filter(nodes, links)
-        nodes, links = self._filter_nodes_links(nodes, links)
-        nodes = self._serialize_nodes_for_cosmograph(nodes)
-        logger.debug(
-            f"After filtering, graph has {len(nodes)} nodes and {len(links or [])} links"
-        )
-        
-        self._graph_has_links = bool(links)
-        if not links and nodes:
-            node_id = nodes[0]["id"]
-            links = [
-                {
-                    "source": node_id,
-                    "target": node_id,
-                    "label": "",
-                    "reverse_label": "",
-                    "group": "__collection_placeholder__",
-                }
+
+class GraphDataView(GraphView):
+    """
+    Stream the nodes and links shown by GraphView as JSON, together with
+    the cosmograph params and legend that depend on them.
+    """
+
+    def get_etag(self):
+        """
+        Return the ETag of the response, derived from the snapshot version
+        and the parameters, or None while the snapshot is being built.
+        """
+        if not self._snapshot_version:
+            return None
+        threshold = getattr(settings, "GRAPH_LOD_THRESHOLD", DEFAULT_LOD_THRESHOLD)
+        key = json.dumps(
+            [
+                GraphSearchSnapshot.CACHE_KEY,
+                self._snapshot_version,
+                self._get_graph_params(),
+                threshold,
             ]
-        return nodes, links
+        )
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def get(self, request, *args, **kwargs):
+        # loads the snapshot version the ETag depends on, get_graph reuses it
+        self._get_snapshot_graph(self._get_selected_collection_ids())
+        etag = self.get_etag()
+        if etag is not None:
+            etag = quote_etag(etag)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified["ETag"] = etag
+                return not_modified
+
+        graph, node_positions, link_positions, sizes = self.get_graph()
+        level = self._get_level_of_detail(graph, node_positions)
+        if level is not None:
+            nodes, links = graph.aggregate(node_positions, link_positions, level)
+            self._graph_has_links = bool(links)
+            header = self._get_header(nodes)
+            header["aggregate"] = {
+                "by": level,
+                "node_count": len(node_positions),
+                "link_count": len(link_positions),
+            }
+            chunks = self._stream_json(
+                header, [nodes], [links or self._placeholder_links(nodes)]
+            )
+        else:
+            self._graph_has_links = bool(len(link_positions))
+            groups = np.unique(graph.node_group[node_positions]).tolist()
+            header = self._get_header([{"group": graph.groups[group]} for group in groups])
+            node_chunks = self._iter_chunks(
+                graph.node_dicts, node_positions, collections=False, sizes=sizes
+            )
+            if len(link_positions):
+                link_chunks = self._iter_chunks(graph.link_dicts, link_positions)
+            else:
+                first_node = graph.node_dicts(node_positions[:1])
+                link_chunks = [self._placeholder_links(first_node)]
+            chunks = self._stream_json(header, node_chunks, link_chunks)
+
+        response = StreamingHttpResponse(chunks, content_type="application/json")
+        # clients have to revalidate, which costs a 304 while nothing changed
+        response["Cache-Control"] = "no-cache"
+        if etag is not None:
+            response["ETag"] = etag
+        return response
+
+    def _get_header(self, nodes):
+        return {
+            "building": self._graph_building,
+            "params": self.get_params(),
+            "legend": self.get_legend(nodes),
+        }
+
+    @staticmethod
+    def _placeholder_links(nodes):
+        # a self link on the first node, so that graphs without links render
+        if not nodes:
+            return []
+        node_id = nodes[0]["id"]
+        return [
+            {
+                "source": node_id,
+                "target": node_id,
+                "label": "",
+                "reverse_label": "",
+                "group": "__collection_placeholder__",
+            }
+        ]
+
+    @classmethod
+    def _stream_json(cls, header, node_chunks, link_chunks):
+        """
+        Write the header and the chunks of node and link dicts as one JSON
+        object, so only one chunk of dicts is held in memory at a time.
+        """
+        yield json.dumps(header)[:-1] + ', "nodes": ['
+        yield from cls._stream_items(node_chunks)
+        yield '], "links": ['
+        yield from cls._stream_items(link_chunks)
+        yield "]}"
+
+    @staticmethod
+    def _stream_items(chunks):
+        separator = ""
+        for chunk in chunks:
+            if chunk:
+                yield separator + json.dumps(chunk)[1:-1]
+                separator = ","
+
+    @staticmethod
+    def _iter_chunks(to_dicts, positions, **kwargs):
+        for start in range(0, len(positions), STREAM_CHUNK_SIZE):
+            yield to_dicts(positions[start : start + STREAM_CHUNK_SIZE], **kwargs)